@@ -0,0 +1,185 @@
+"""Synthetic confs built from the registered node types.
+
+Attribute values are derived from the pydantic fields of every class in
+node_subclass_registry, so new node types are covered without changes here.
+
+    python -m benchmarks.generator --nodes 1000 --shape chain --nested > conf.toml
+"""
+
+import argparse
+import itertools
+import random
+import sys
+
+from enum import Enum
+
+from typing import Optional, List, Dict, Any
+
+import toml
+
+from pydantic import BaseModel, ValidationError
+from pydantic.fields import ModelField, SHAPE_LIST, SHAPE_SET, SHAPE_SEQUENCE, SHAPE_MAPPING, SHAPE_DICT
+from pydantic.typing import is_literal_type, literal_values
+
+from models.conf import Conf, parse_nodes
+from models.usertypes import NodeRole, node_subclass_registry
+
+
+#  fields filled by the generator itself
+NODE_FIELDS = ("type", "role", "name", "inputs")
+
+
+class Unsupported(Exception):
+    pass
+
+
+def scalar_value(tp, field_name: str, nested: bool) -> Any:
+    if is_literal_type(tp):
+        return literal_values(tp)[0]
+    if isinstance(tp, type):
+        if issubclass(tp, Enum):
+            return next(iter(tp)).value
+        if issubclass(tp, BaseModel):
+            return model_attrs(tp, nested)
+        if issubclass(tp, bool):
+            return True
+        if issubclass(tp, int):
+            return 1
+        if issubclass(tp, float):
+            return 1.0
+        if issubclass(tp, str):
+            return f"{field_name}_value"
+    raise Unsupported(f"Cannot generate a value for {field_name}: {tp}")
+
+
+def field_value(field: ModelField, nested: bool) -> Any:
+    if field.sub_fields and field.shape not in (SHAPE_LIST, SHAPE_SET, SHAPE_SEQUENCE, SHAPE_MAPPING, SHAPE_DICT):
+        #  Union: the first type which can be generated
+        for sub in field.sub_fields:
+            try:
+                return field_value(sub, nested)
+            except Unsupported:
+                pass
+        raise Unsupported(f"Cannot generate a value for {field.name}")
+    value = scalar_value(field.type_, field.name, nested)
+    if field.shape in (SHAPE_LIST, SHAPE_SET, SHAPE_SEQUENCE):
+        return [value]
+    if field.shape in (SHAPE_MAPPING, SHAPE_DICT):
+        return {"key": value}
+    return value
+
+
+def model_attrs(cls, nested: bool, skip=(), extra=None) -> Dict[str, Any]:
+    """Attributes which validate as `cls`: every optional field when `nested`,
+    falling back to the required ones if validators reject the combination"""
+    for fill_all in ((True, False) if nested else (False,)):
+        attrs = {}
+        for name, field in cls.__fields__.items():
+            if name in skip or not (field.required or fill_all):
+                continue
+            try:
+                attrs[name] = field_value(field, nested)
+            except Unsupported:
+                if field.required:
+                    raise
+        try:
+            cls(**attrs, **(extra or {}))
+        except (ValidationError, TypeError):
+            continue
+        return attrs
+    raise Unsupported(f"Cannot generate valid attributes for {cls.__name__}")
+
+
+def node_templates(nested: bool = False) -> Dict[str, List[Dict[str, Any]]]:
+    """Valid attributes (without name and inputs) of every registered node type, by role"""
+    templates = {}
+    for role, classes in node_subclass_registry.node_classes().items():
+        for node_type, cls in sorted(classes.items()):
+            attrs = model_attrs(cls, nested, skip=NODE_FIELDS, extra=dict(role=role, name="template"))
+            templates.setdefault(role, []).append(dict(type=node_type, **attrs))
+    return templates
+
+
+class Builder:
+
+    def __init__(self, nested: bool, seed: int):
+        self.templates = node_templates(nested)
+        self.cycles = {role: itertools.cycle(t) for role, t in self.templates.items()}
+        self.random = random.Random(seed)
+        self.conf = {role.value: {} for role in NodeRole}
+
+    def add(self, role: NodeRole, name: str, inputs: Optional[List[str]] = None) -> str:
+        attrs = dict(next(self.cycles[role.value]))
+        if inputs is not None:
+            attrs["inputs"] = inputs
+        self.conf[role.value][name] = attrs
+        return name
+
+
+def fan_in(b: Builder, size: int, width: int = 0):
+    """All sources into one transform, then into `width` sinks"""
+    width = width or max(1, size // 100)
+    sources = [b.add(NodeRole.sources, f"src{i}") for i in range(max(1, size - width - 1))]
+    merge = b.add(NodeRole.transforms, "merge", sources)
+    for i in range(width):
+        b.add(NodeRole.sinks, f"out{i}", [merge])
+
+
+def chain(b: Builder, size: int, width: int = 0):
+    """`width` chains of transforms, each from its own source to its own sink"""
+    width = width or max(1, size // 1000)
+    length = max(1, size // width - 2)
+    for c in range(width):
+        prev = b.add(NodeRole.sources, f"src{c}")
+        for i in range(length):
+            prev = b.add(NodeRole.transforms, f"t{c}_{i}", [prev])
+        b.add(NodeRole.sinks, f"out{c}", [prev])
+
+
+def mesh(b: Builder, size: int, width: int = 0):
+    """Layers of transforms, each reading from a few nodes of the previous layer"""
+    def inputs(i, layer):
+        #  every node of the previous layer is consumed at least once
+        return sorted({layer[i % len(layer)], *b.random.sample(layer, min(2, len(layer)))})
+
+    width = width or max(1, int(size ** 0.5))
+    layer = [b.add(NodeRole.sources, f"src{i}") for i in range(width)]
+    count, depth = width, 0
+    while count + 2 * width <= size:
+        depth += 1
+        layer = [
+            b.add(NodeRole.transforms, f"t{depth}_{i}", inputs(i, layer))
+            for i in range(width)
+        ]
+        count += width
+    for i in range(size - count):
+        b.add(NodeRole.sinks, f"out{i}", inputs(i, layer))
+
+
+SHAPES = dict(fan_in=fan_in, chain=chain, mesh=mesh)
+
+
+def generate(size: int, shape: str = "mesh", nested: bool = False, width: int = 0, seed: int = 0) -> str:
+    """TOML text of a conf with about `size` nodes"""
+    b = Builder(nested, seed)
+    SHAPES[shape](b, size, width)
+    return toml.dumps(b.conf)
+
+
+def generate_conf(size: int, shape: str = "mesh", nested: bool = False, width: int = 0, seed: int = 0) -> Conf:
+    return Conf(parse_nodes(generate(size, shape, nested, width, seed)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="mesh")
+    parser.add_argument("--width", type=int, default=0, help="sinks for fan_in, chains for chain, layer width for mesh")
+    parser.add_argument("--nested", action="store_true", help="fill optional nested options (buffer, batch, tls...)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.stdout.write(generate(args.nodes, args.shape, args.nested, args.width, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Benchmark runner.
+
+Times Conf.deserialize, Conf.serialize, display_dict and the HTTP endpoints
+(through an in-process ASGI client) on generated confs, saves the results
+as JSON and compares them with a previous run.
+
+    python -m benchmarks.run --nodes 1000,5000 --output after.json --baseline before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from typing import Optional, List, Dict, Any, Callable, Tuple
+from urllib.parse import urlencode
+
+from models.conf import Conf
+
+from .generator import SHAPES, generate
+
+
+class AsgiClient:
+    """Just enough of an HTTP client to call an ASGI app in process"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: Any = None,
+            headers: Optional[Dict[str, str]] = None, params: Optional[Dict[str, str]] = None
+            ) -> Tuple[int, Dict[str, str], bytes]:
+        raw = json.dumps(body).encode("utf-8") if body is not None else b""
+        scope_headers = [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(raw)).encode()),
+        ] + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urlencode(params or {}).encode(),
+            "root_path": "",
+            "headers": scope_headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+        }
+        received = False
+        response = {"status": 0, "headers": {}, "body": []}
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {"type": "http.request", "body": raw, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return response["status"], response["headers"], b"".join(response["body"])
+
+
+def measure(func: Callable, repeat: int, loop: asyncio.AbstractEventLoop) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        if asyncio.iscoroutine(result):
+            loop.run_until_complete(result)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summary(times: List[float]) -> Dict[str, Any]:
+    return dict(
+        runs=len(times),
+        min_ms=min(times) * 1000,
+        median_ms=statistics.median(times) * 1000,
+        mean_ms=statistics.mean(times) * 1000,
+    )
+
+
+def model_cases(text: str) -> List[Tuple[str, Callable]]:
+    conf = Conf()
+    conf.deserialize(text)
+
+    def serialize():
+        conf.serialize()
+
+    def display():
+        for node in conf:
+            node.display_dict()
+
+    def topology():
+        conf.revision += 1
+        conf.topology()
+
+    return [
+        ("deserialize", lambda: Conf().deserialize(text)),
+        ("serialize", serialize),
+        ("display_dict", display),
+        ("topology", topology),
+    ]
+
+
+def http_cases(client: AsgiClient, text: str, loop) -> List[Tuple[str, Callable]]:
+    conf_id = "bench"
+    loop.run_until_complete(client.request("POST", f"/conf/{conf_id}/text", {"text": text}))
+    _, headers, _ = loop.run_until_complete(client.request("GET", f"/conf/{conf_id}/text"))
+    etag = headers.get("etag", "")
+    _, _, body = loop.run_until_complete(client.request(
+        "GET", f"/conf/{conf_id}/items", params={"range": "[0, 1]"}))
+    key = json.loads(body)[0]["id"]
+
+    async def check(method, path, body=None, expect=(200, 201, 304), **kwargs):
+        status, _, content = await client.request(method, path, body, **kwargs)
+        if status not in expect:
+            raise RuntimeError(f"{method} {path}: {status} {content[:200]!r}")
+
+    page = {"sort": json.dumps(["name", "ASC"]), "range": "[100, 125]"}
+    #  the 304 case goes first: the writes after it change the ETag
+    return [
+        ("GET /conf/{id}/text 304", lambda: check(
+            "GET", f"/conf/{conf_id}/text", headers={"If-None-Match": etag}, expect=(304,))),
+        ("POST /conf/{id}/text", lambda: check("POST", f"/conf/{conf_id}/text", {"text": text})),
+        ("GET /conf/{id}/text", lambda: check("GET", f"/conf/{conf_id}/text")),
+        ("GET /conf/{id}/items page", lambda: check("GET", f"/conf/{conf_id}/items", params=page)),
+        ("GET /conf/{id}/items/{key}", lambda: check("GET", f"/conf/{conf_id}/items/{key}")),
+        ("PATCH /conf/{id}/items", lambda: check(
+            "PATCH", f"/conf/{conf_id}/items", [{"op": "merge", "key": key, "attrs": {}}])),
+        ("GET /conf/{id}/topology", lambda: check("GET", f"/conf/{conf_id}/topology")),
+    ]
+
+
+def versions() -> Dict[str, str]:
+    result = {"python": platform.python_version()}
+    for name in ("pydantic", "toml", "fastapi", "starlette"):
+        try:
+            result[name] = getattr(__import__(name), "__version__", "?")
+        except ImportError:
+            pass
+    if "pydantic" in result:
+        from pydantic.version import VERSION
+        result["pydantic"] = str(VERSION)
+    return result
+
+
+def run(args) -> Dict[str, Any]:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    client = None
+    if args.http:
+        #  main reads its settings at import
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+        import main
+        loop.run_until_complete(main.app.router.startup())
+        client = AsgiClient(main.app)
+    try:
+        for shape in args.shapes:
+            for size in args.nodes:
+                text = generate(size, shape, args.nested)
+                label = f"{shape}-{size}{'-nested' if args.nested else ''}"
+                cases = model_cases(text)
+                if client is not None:
+                    cases += http_cases(client, text, loop)
+                for name, func in cases:
+                    full_name = f"{name} [{label}]"
+                    if args.only and args.only not in full_name:
+                        continue
+                    times = measure(func, args.repeat, loop)
+                    results[full_name] = summary(times)
+                    print(f"{full_name:55} median {results[full_name]['median_ms']:10.2f} ms", file=sys.stderr)
+    finally:
+        if client is not None:
+            loop.run_until_complete(main.app.router.shutdown())
+        loop.close()
+    return {"meta": dict(versions(), repeat=args.repeat, time=time.time()), "results": results}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Names of benchmarks whose median grew by more than `max_regression` (0.2 = 20%)"""
+    regressions = []
+    for name, result in sorted(current["results"].items()):
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else 1.0
+        flag = "REGRESSION" if ratio > 1 + max_regression else ""
+        print(f"{name:55} {before['median_ms']:10.2f} -> {result['median_ms']:10.2f} ms  x{ratio:5.2f} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", default="1000", help="comma separated conf sizes")
+    parser.add_argument("--shapes", default="mesh", help=f"comma separated, of: {', '.join(sorted(SHAPES))}")
+    parser.add_argument("--nested", action="store_true", help="fill optional nested options")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="run benchmarks whose name contains this")
+    parser.add_argument("--no-http", dest="http", action="store_false", help="skip the endpoints")
+    parser.add_argument("--output", help="save results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail when a median grows by more than this fraction of the baseline")
+    args = parser.parse_args()
+    args.nodes = [int(n) for n in args.nodes.split(",")]
+    args.shapes = args.shapes.split(",")
+
+    current = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
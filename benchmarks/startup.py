@@ -0,0 +1,98 @@
+"""Import and startup times with many node type plugins.
+
+Writes `--plugins` generated sink plugins into a temporary directory and
+times, each in a fresh interpreter: importing the models, importing the
+app, the first use of a plugin type (finding plugins and importing one)
+and importing all of them, as eager registration would at startup.
+
+    python -m benchmarks.startup [--plugins 50] [--fields 20] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from typing import Dict
+
+
+PLUGIN = '''\
+from typing import Optional, List
+
+from typing_extensions import Literal
+
+from pydantic import BaseModel
+
+from models.nodes import DescendantNode
+from models.usertypes import NodeRole, node_subclass_registry
+
+
+class BenchOptions{n}(BaseModel):
+{options}
+
+
+@node_subclass_registry(NodeRole.sinks)
+class SinkBench{n}(DescendantNode):
+    type: Literal['bench_{n}'] = 'bench_{n}'
+    options: Optional[BenchOptions{n}]
+{fields}
+'''
+
+
+PROBE = '''\
+import json, sys, time
+timings = {}
+t = time.perf_counter()
+import models.conf
+from models.usertypes import NodeRole, node_subclass_registry
+timings["import_models"] = time.perf_counter() - t
+t = time.perf_counter()
+import main
+timings["import_app"] = time.perf_counter() - t
+t = time.perf_counter()
+models.conf.build_node(NodeRole.sinks, "out", {"type": "bench_0", "inputs": ["in"]})
+timings["first_plugin_use"] = time.perf_counter() - t
+t = time.perf_counter()
+node_subclass_registry.node_classes()
+timings["import_all_plugins"] = time.perf_counter() - t
+json.dump(timings, sys.stdout)
+'''
+
+
+def write_plugins(directory: str, count: int, fields: int):
+    for n in range(count):
+        options = "\n".join(f"    option_{i}: Optional[int]" for i in range(fields // 2)) or "    pass"
+        body = "\n".join(
+            f"    field_{i}: {'Optional[List[str]]' if i % 3 == 0 else 'Optional[str]'}" for i in range(fields))
+        with open(os.path.join(directory, f"bench_{n}.py"), "w") as f:
+            f.write(PLUGIN.format(n=n, options=options, fields=body))
+
+
+def probe(plugin_dir: str) -> Dict[str, float]:
+    env = dict(os.environ, NODE_PLUGIN_DIRS=plugin_dir, WORKERS="0")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=root, env=env, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plugins", type=int, default=50)
+    parser.add_argument("--fields", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as plugin_dir:
+        write_plugins(plugin_dir, args.plugins, args.fields)
+        runs = [probe(plugin_dir) for _ in range(args.repeat)]
+    for name in runs[0]:
+        median = statistics.median(run[name] for run in runs)
+        print(f"{name:20} plugins={args.plugins:4} median={median * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Topology benchmarks on generated pipelines.
+
+    python -m benchmarks.topology [--nodes 10000] [--repeat 5]
+"""
+
+import argparse
+import random
+import time
+
+from models.conf import Conf, build_node
+from models.usertypes import NodeRole
+
+
+def source(name):
+    return build_node(NodeRole.sources, name, {"type": "generator", "lines": ["x"]})
+
+
+def transform(name, inputs):
+    return build_node(NodeRole.transforms, name, {"type": "sampler", "rate": 10, "inputs": inputs})
+
+
+def sink(name, inputs):
+    return build_node(NodeRole.sinks, name, {"type": "blackhole", "print_amount": 1, "inputs": inputs})
+
+
+def chain(size: int) -> Conf:
+    """source -> t1 -> t2 -> ... -> sink"""
+    conf = Conf([source("src")])
+    prev = "src"
+    for i in range(size - 2):
+        conf.add(transform(f"t{i}", [prev]))
+        prev = f"t{i}"
+    conf.add(sink("out", [prev]))
+    return conf
+
+
+def fan_in(size: int) -> Conf:
+    """many sources into one transform"""
+    names = [f"src{i}" for i in range(size - 2)]
+    conf = Conf(source(name) for name in names)
+    conf.add(transform("merge", names))
+    conf.add(sink("out", ["merge"]))
+    return conf
+
+
+def layered(size: int, width: int = 100, fanout: int = 3, seed: int = 0) -> Conf:
+    """random DAG: each transform and sink reads from a few nodes of the previous layer"""
+    rnd = random.Random(seed)
+    layer = [f"src{i}" for i in range(width)]
+    conf = Conf(source(name) for name in layer)
+    n = len(conf)
+    depth = 0
+    while n < size - width:
+        depth += 1
+        nxt = [f"t{depth}_{i}" for i in range(width)]
+        for name in nxt:
+            conf.add(transform(name, rnd.sample(layer, min(fanout, len(layer)))))
+        layer = nxt
+        n += width
+    for i in range(size - n):
+        conf.add(sink(f"out{i}", rnd.sample(layer, min(fanout, len(layer)))))
+    return conf
+
+
+SHAPES = dict(chain=chain, fan_in=fan_in, layered=layered)
+
+
+def bench(conf: Conf, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        #  a change drops the cached report
+        conf.revision += 1
+        start = time.perf_counter()
+        conf.topology()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for name, shape in SHAPES.items():
+        conf = shape(args.nodes)
+        best = bench(conf, args.repeat)
+        report = conf.topology()
+        print(f"{name:10} nodes={len(conf):7} ordered={len(report.order):7} best={best * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
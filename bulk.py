@@ -0,0 +1,154 @@
+"""Import and export of many confs at once.
+
+Imports read (conf id, TOML) pairs from NDJSON lines or from a tar archive
+of `<conf id>.toml` files, parse and validate them in the worker processes
+and store those which are valid in one transaction. Exports stream such
+an archive conf by conf, so it is never built in memory.
+"""
+
+import io
+import json
+import tarfile
+import time
+
+from typing import Optional, List, Dict, Tuple, Iterable, Iterator, AsyncIterator
+
+from db.store import ConfStore
+from workers import ConfWorkers
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.imported: List[str] = []
+        #  messages by conf id, or by position of the entry when it has no id
+        self.errors: Dict[str, str] = {}
+
+    def dict(self) -> dict:
+        return dict(imported=self.imported, errors=self.errors)
+
+
+def read_ndjson(lines: Iterable[bytes]) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """(conf id, TOML, error) of each line {"id": ..., "toml": ...}"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            yield str(entry["id"]), str(entry["toml"]), None
+        except (ValueError, KeyError, TypeError) as e:
+            yield f"line {number}", None, f"Not an entry with id and toml: {e}"
+
+
+def read_tar(fileobj) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """(conf id, TOML, error) of each `<conf id>.toml` file of a tar archive,
+    compressed or not. Other files are skipped."""
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                name = member.name.rsplit("/", 1)[-1]
+                if not member.isfile() or not name.endswith(".toml"):
+                    continue
+                conf_id = name[:-len(".toml")]
+                try:
+                    yield conf_id, archive.extractfile(member).read().decode("utf-8"), None
+                except UnicodeDecodeError as e:
+                    yield conf_id, None, str(e)
+    except tarfile.TarError as e:
+        raise BulkImportError(f"Not a tar archive: {e}")
+
+
+async def import_confs(store: ConfStore, workers: ConfWorkers,
+        entries: Iterable[Tuple[str, Optional[str], Optional[str]]], atomic: bool = False) -> ImportReport:
+    """Parse the entries in the workers and store the valid ones in one
+    transaction; with `atomic`, store nothing if any is not valid"""
+    report = ImportReport()
+    texts: Dict[str, str] = {}
+    for conf_id, text, error in entries:
+        if error is not None:
+            report.errors[conf_id] = error
+        elif conf_id in texts or conf_id in report.errors:
+            report.errors[conf_id] = "More than one entry for this conf"
+            texts.pop(conf_id, None)
+        else:
+            texts[conf_id] = text
+
+    results = await workers.deserialize_many(list(texts.values()))
+    parsed = []
+    for conf_id, result in zip(texts, results):
+        if isinstance(result, Exception):
+            report.errors[conf_id] = str(result)
+        else:
+            parsed.append((conf_id,) + result)
+    if atomic and report.errors:
+        return report
+
+    for conf_id, conf, _ in parsed:
+        #  keep revisions (and so ETags) of the same conf id moving forward
+        conf.revision += await store.effective_revision(conf_id) or 0
+    await store.save_many(parsed)
+    report.imported = [conf_id for conf_id, _, _ in parsed]
+    return report
+
+
+class _Chunks(io.RawIOBase):
+    """Write-only file which hands over what was written when asked"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def export_tar(store: ConfStore, workers: ConfWorkers, conf_ids: Iterable[str]) -> AsyncIterator[bytes]:
+    """Tar archive of `<conf id>.toml` files, one conf in memory at a time.
+    Overlays are exported as their effective conf."""
+    chunks = _Chunks()
+    archive = tarfile.open(fileobj=chunks, mode="w|")
+    for conf_id in conf_ids:
+        text = await _render(store, workers, conf_id)
+        if text is None:
+            continue
+        data = text.encode("utf-8")
+        member = tarfile.TarInfo(f"{conf_id}.toml")
+        member.size = len(data)
+        member.mtime = int(time.time())
+        member.mode = 0o644
+        archive.addfile(member, io.BytesIO(data))
+        yield chunks.take()
+    archive.close()
+    yield chunks.take()
+
+
+async def export_ndjson(store: ConfStore, workers: ConfWorkers, conf_ids: Iterable[str]) -> AsyncIterator[bytes]:
+    """One line {"id": ..., "toml": ...} per conf"""
+    for conf_id in conf_ids:
+        text = await _render(store, workers, conf_id)
+        if text is not None:
+            yield (json.dumps({"id": conf_id, "toml": text}) + "\n").encode("utf-8")
+
+
+async def _render(store: ConfStore, workers: ConfWorkers, conf_id: str) -> Optional[str]:
+    try:
+        conf = await store.get(conf_id)
+    except ValueError:
+        #  broken overlay chain
+        return None
+    if conf is None:
+        #  deleted since the export started
+        return None
+    return (await workers.render(conf)).text
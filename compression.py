@@ -0,0 +1,84 @@
+"""Response bodies streamed in chunks, compressed as Accept-Encoding allows.
+
+zstd needs the zstandard package; without it only gzip is offered.
+"""
+
+import zlib
+
+from typing import Optional, List, Iterable, Iterator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+#  bytes gathered before a chunk is sent: a node is far less
+CHUNK_SIZE = 64 * 1024
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def available() -> List[str]:
+    """Encodings offered, preferred first"""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The available encoding the client weighs most (ties go to the
+    preferred one), None for the body as it is"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in available():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def _compressor(encoding: Optional[str]):
+    if encoding is None:
+        return None
+    if encoding == "gzip":
+        #  wbits 16 + 15: a gzip header and trailer around the deflate stream
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def encode(chunks: Iterable[str], encoding: Optional[str] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """UTF-8 of the text chunks, compressed with `encoding` if given, in
+    chunks of about `chunk_size` bytes. Holds one chunk at a time."""
+    compressor = _compressor(encoding)
+    pending: List[bytes] = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            pending.append(data)
+            size += len(data)
+        if size >= chunk_size:
+            yield b"".join(pending)
+            pending, size = [], 0
+    if compressor is not None:
+        pending.append(compressor.flush())
+    tail = b"".join(pending)
+    if tail:
+        yield tail
@@ -0,0 +1,61 @@
+import fcntl
+import mmap
+import os
+import struct
+
+from contextlib import contextmanager
+
+from typing import Optional
+
+
+_COUNTER = struct.Struct("<Q")
+
+
+class ChangeCounter:
+    """A counter in a small file mapped by every worker process on the host.
+
+    Each write to the store bumps it after its transaction commits, so a
+    worker learns that some conf changed by reading 8 bytes of shared memory
+    and queries the database only when the value moved.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            if os.fstat(self._fd).st_size < _COUNTER.size:
+                os.ftruncate(self._fd, _COUNTER.size)
+        self._map = mmap.mmap(self._fd, _COUNTER.size)
+
+    def value(self) -> int:
+        return _COUNTER.unpack_from(self._map)[0]
+
+    def bump(self) -> int:
+        with self._locked():
+            value = self.value() + 1
+            _COUNTER.pack_into(self._map, 0, value)
+        return value
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def counter_path(database_url: str, path: str = "") -> Optional[str]:
+    """Where the counter of a database lives: `path` if given, else next to
+    an SQLite database file. None for other databases, whose workers may run
+    on different hosts and have to ask the database itself."""
+    if path:
+        return path
+    prefix = "sqlite:///"
+    if database_url.startswith(prefix) and ":memory:" not in database_url:
+        return database_url[len(prefix):].split("?")[0] + ".changes"
+    return None
@@ -0,0 +1,130 @@
+"""Revision history of confs: an append-only log with a row per revision.
+
+A row of a full conf holds a delta: the nodes changed since the previous
+revision and the keys of those removed. Once the deltas since the last
+snapshot add up to more than it, a snapshot of all nodes is stored
+instead. A revision is then rebuilt from one snapshot and deltas no
+larger than it, whatever the number of revisions, and a conf edited a node
+at a time takes about the size of its edits.
+
+Overlays store their overrides at every revision: they are small.
+
+Node attributes are kept as stored in conf_nodes (canonical JSON), and
+nodes in the order of their rows there.
+"""
+
+from collections import OrderedDict
+
+from typing import Optional, List, Dict, Tuple, Any, Iterable, Awaitable, Callable
+
+import json
+import time
+
+import databases
+
+from .meta import conf_revisions
+
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+OVERLAY = "overlay"
+
+#  row columns listed, the bodies are left out
+ENTRY_COLUMNS = ("revision", "kind", "size", "created")
+
+
+def snapshot_body(nodes: Iterable[Tuple[str, str]]) -> str:
+    """All nodes, from (key, attrs JSON) pairs in storage order"""
+    return '{"nodes":[' + ",".join(f"[{json.dumps(key)},{attrs}]" for key, attrs in nodes) + "]}"
+
+
+def delta_body(changed: Iterable[Tuple[str, str]], removed: Iterable[str],
+        order: Optional[List[str]] = None) -> str:
+    """Changed nodes as (key, attrs JSON) pairs, keys of removed ones and,
+    if applying them does not give it, the new order of keys"""
+    body = '{"changed":[' + ",".join(f"[{json.dumps(key)},{attrs}]" for key, attrs in changed) + "]"
+    body += f',"removed":{json.dumps(list(removed))}'
+    if order is not None:
+        body += f',"order":{json.dumps(order)}'
+    return body + "}"
+
+
+def apply_delta(nodes: "OrderedDict[str, Any]", delta: Dict[str, Any]):
+    """As conf_nodes changes: changed nodes keep their place, new ones go last"""
+    for key in delta["removed"]:
+        nodes.pop(key, None)
+    for key, attrs in delta["changed"]:
+        nodes[key] = attrs
+    order = delta.get("order")
+    if order is not None:
+        for key in order:
+            nodes.move_to_end(key)
+
+
+def applied_order(keys: List[str], changed: Iterable[str], removed: Iterable[str]) -> List[str]:
+    """Order of keys apply_delta gives"""
+    nodes = OrderedDict.fromkeys(keys)
+    apply_delta(nodes, {"changed": [(key, None) for key in changed], "removed": list(removed)})
+    return list(nodes)
+
+
+async def append(database: databases.Database, conf_id: str, revision: int, delta: str,
+        snapshot: Callable[[], Awaitable[str]]):
+    """Add the row of a full conf's revision: `delta` from the previous one,
+    or the body `snapshot` gives when the deltas would outgrow the snapshot"""
+    previous = await database.fetch_one(
+        conf_revisions.select().with_only_columns(
+            [conf_revisions.c.kind, conf_revisions.c.base, conf_revisions.c.chain]
+        ).where(conf_revisions.c.conf_id == conf_id).order_by(conf_revisions.c.revision.desc()).limit(1))
+    if previous is not None and previous["kind"] != OVERLAY:
+        base_size = await database.fetch_val(
+            conf_revisions.select().with_only_columns([conf_revisions.c.size]).where(
+                (conf_revisions.c.conf_id == conf_id) & (conf_revisions.c.revision == previous["base"])))
+        chain = previous["chain"] + len(delta)
+        if base_size is not None and chain <= base_size:
+            await _insert(database, conf_id, revision, DELTA, delta, base=previous["base"], chain=chain)
+            return
+    await _insert(database, conf_id, revision, SNAPSHOT, await snapshot(), base=revision)
+
+
+async def append_overlay(database: databases.Database, conf_id: str, revision: int,
+        parent: str, overrides: Dict[str, Any]):
+    body = json.dumps({"parent": parent, "nodes": overrides})
+    await _insert(database, conf_id, revision, OVERLAY, body, base=revision)
+
+
+async def _insert(database: databases.Database, conf_id: str, revision: int, kind: str, body: str,
+        base: int, chain: int = 0):
+    await database.execute(conf_revisions.insert().values(
+        conf_id=conf_id, revision=revision, kind=kind, base=base, size=len(body), chain=chain,
+        created=time.time(), body=body))
+
+
+async def entries(database: databases.Database, conf_id: str) -> List[Dict[str, Any]]:
+    """Revisions of the conf, latest first"""
+    query = conf_revisions.select().with_only_columns(
+        [conf_revisions.c[name] for name in ENTRY_COLUMNS]
+    ).where(conf_revisions.c.conf_id == conf_id).order_by(conf_revisions.c.revision.desc())
+    return [{name: row[name] for name in ENTRY_COLUMNS} for row in await database.fetch_all(query)]
+
+
+async def rebuild(database: databases.Database, conf_id: str, revision: int) -> Optional[Tuple[str, Any]]:
+    """("overlay", {"parent", "nodes"}) or ("conf", attrs by key, in order)
+    of the conf at a revision; None if it was not logged"""
+    row = await database.fetch_one(
+        conf_revisions.select().with_only_columns([conf_revisions.c.kind, conf_revisions.c.base]).where(
+            (conf_revisions.c.conf_id == conf_id) & (conf_revisions.c.revision == revision)))
+    if row is None:
+        return None
+    query = conf_revisions.select().with_only_columns([conf_revisions.c.kind, conf_revisions.c.body]).where(
+        (conf_revisions.c.conf_id == conf_id)
+        & (conf_revisions.c.revision >= row["base"]) & (conf_revisions.c.revision <= revision)
+    ).order_by(conf_revisions.c.revision)
+    rows = await database.fetch_all(query)
+    if row["kind"] == OVERLAY:
+        return OVERLAY, json.loads(rows[-1]["body"])
+    nodes: "OrderedDict[str, Any]" = OrderedDict(json.loads(rows[0]["body"])["nodes"])
+    for delta in rows[1:]:
+        apply_delta(nodes, json.loads(delta["body"]))
+    return "conf", nodes
+
@@ -0,0 +1,105 @@
+import sqlalchemy
+
+from sqlalchemy import \
+    Table, \
+    Column, \
+    Integer, \
+    Float, \
+    String, \
+    Text, \
+    ForeignKey, \
+    Index, \
+    UniqueConstraint
+
+
+metadata = sqlalchemy.MetaData()
+
+
+confs = Table(
+    "confs",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("revision", Integer, nullable=False, default=0),
+    #  overlay confs: id of the conf they override and the overrides (JSON),
+    #  they have no rows in conf_nodes
+    Column("parent", String, nullable=True, index=True),
+    Column("overlay", Text, nullable=True),
+)
+
+
+#  One row per node. Rows keep the order of nodes in a conf by their id,
+#  so a change of one node touches one row.
+conf_nodes = Table(
+    "conf_nodes",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("conf_id", String, ForeignKey("confs.id", ondelete="CASCADE"), nullable=False, index=True),
+    Column("key", String, nullable=False),
+    Column("role", String, nullable=False),
+    Column("name", String, nullable=False),
+    Column("type", String, nullable=False),
+    Column("attrs", Text, nullable=False),
+    UniqueConstraint("conf_id", "key"),
+)
+
+
+#  Inverted index for search across confs: one row per (node, field, value),
+#  see search.node_terms. Overlay confs have rows for the nodes they
+#  override or add, with the values of their effective nodes.
+conf_terms = Table(
+    "conf_terms",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("conf_id", String, ForeignKey("confs.id", ondelete="CASCADE"), nullable=False),
+    Column("key", String, nullable=False),
+    Column("field", String, nullable=False),
+    Column("value", String, nullable=False),
+    Index("ix_conf_terms_field_value", "field", "value"),
+    #  also checks a node for a term without going through the other index
+    Index("ix_conf_terms_node", "conf_id", "key", "field", "value"),
+)
+
+
+#  Revision history, append-only: one row per revision of a conf, see
+#  history.py. `base` is the revision of the snapshot a delta applies to
+#  and `chain` the size of the deltas since that snapshot, this one included.
+conf_revisions = Table(
+    "conf_revisions",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("conf_id", String, nullable=False),
+    Column("revision", Integer, nullable=False),
+    Column("kind", String, nullable=False),
+    Column("base", Integer, nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("chain", Integer, nullable=False, default=0),
+    Column("created", Float, nullable=False),
+    Column("body", Text, nullable=False),
+    UniqueConstraint("conf_id", "revision"),
+)
+
+
+def ensure_schemas(database_url: str):
+    connect_args = {}
+    if database_url.startswith("sqlite"):
+        connect_args["check_same_thread"] = False
+    engine = sqlalchemy.create_engine(database_url, connect_args=connect_args)
+    try:
+        metadata.create_all(engine)
+        _add_missing_columns(engine)
+    except sqlalchemy.exc.DatabaseError:
+        #  another app process, started at the same time, created them first
+        metadata.create_all(engine)
+        _add_missing_columns(engine)
+    engine.dispose()
+
+
+def _add_missing_columns(engine):
+    """Columns added to existing tables since they were created (all nullable)"""
+    inspector = sqlalchemy.inspect(engine)
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(engine.dialect)
+                engine.execute(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
@@ -0,0 +1,157 @@
+"""Search across confs through an inverted index of node fields.
+
+Every node of a stored conf has rows in conf_terms for its role, name and
+type and for the values of its fields: scalars, each element of lists of
+scalars (such as `include` and `inputs`) and nested options by dotted path
+(`buffer.type`). A search looks up its rarest criterion in the index and
+checks the others on the nodes found, so it costs in proportion to the
+matches, not to the number of confs.
+
+Overlays have rows only for the nodes they override or add; the nodes
+they take from their parent match where the parent's do.
+"""
+
+from enum import Enum
+
+from typing import Optional, List, Dict, Set, Tuple, Any, Mapping, Collection, Iterator
+
+import json
+
+import sqlalchemy
+
+import databases
+
+from .meta import confs, conf_terms
+
+
+#  indexed whatever fields are selected
+ALWAYS_INDEXED = ("role", "name", "type")
+
+#  longer values (e.g. scripts) are not indexed
+MAX_VALUE_LENGTH = 256
+
+#  ids per IN (...) query
+CHUNK = 500
+
+#  matches of a criterion counted when choosing which one to look up first
+COUNT_LIMIT = 1000
+
+
+def term_value(value: Any) -> Optional[str]:
+    """Indexed form of a scalar value, as it is given in a search; None if not indexed"""
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return value if len(value) <= MAX_VALUE_LENGTH else None
+    if isinstance(value, (int, float)):
+        return json.dumps(value)
+    return None
+
+
+def node_terms(role: str, name: str, attrs: Mapping[str, Any],
+        fields: Optional[Collection[str]] = None) -> List[Tuple[str, str]]:
+    """(field, value) pairs of a node, each once. With `fields`, only those
+    (by dotted path) besides role, name and type."""
+    terms = [("role", role), ("name", name)]
+    for field, value in _flatten(attrs):
+        if fields and field not in fields and field not in ALWAYS_INDEXED:
+            continue
+        value = term_value(value)
+        if value is not None:
+            terms.append((field, value))
+    return list(dict.fromkeys(terms))
+
+
+def _flatten(attrs: Mapping[str, Any], prefix: str = "") -> Iterator[Tuple[str, Any]]:
+    for name, value in attrs.items():
+        path = f"{prefix}{name}"
+        if isinstance(value, Mapping):
+            yield from _flatten(value, f"{path}.")
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                if not isinstance(item, (Mapping, list, tuple)):
+                    yield path, item
+        else:
+            yield path, value
+
+
+def term_rows(conf_id: str, key: str, node, fields: Optional[Collection[str]] = None) -> List[dict]:
+    return [
+        dict(conf_id=conf_id, key=key, field=field, value=value)
+        for field, value in node_terms(node.role.value, node.name, node.dict(), fields)
+    ]
+
+
+async def search(database: databases.Database, criteria: List[Tuple[str, str]],
+        prefix: bool = False) -> Dict[str, List[str]]:
+    """Keys of the nodes which match all (field, value) criteria, by conf id.
+    With `prefix`, values match those they start."""
+    if not criteria:
+        raise ValueError("No search criteria")
+    if len(criteria) > 1:
+        #  the rarest term drives the lookup, the node must have the others too
+        #  (counted up to a bound: telling a rare term from a common one is enough)
+        counts = []
+        for field, value in criteria:
+            rows = sqlalchemy.select([conf_terms.c.id]).where(
+                _matches(conf_terms, field, value, prefix)).limit(COUNT_LIMIT).alias()
+            counts.append(await database.fetch_val(sqlalchemy.select([sqlalchemy.func.count()]).select_from(rows)))
+        criteria = [c for _, c in sorted(zip(counts, criteria))]
+    (field, value), *others = criteria
+    query = sqlalchemy.select([conf_terms.c.conf_id, conf_terms.c.key]).where(
+        _matches(conf_terms, field, value, prefix))
+    for field, value in others:
+        other = conf_terms.alias()
+        query = query.where(sqlalchemy.exists().where(
+            (other.c.conf_id == conf_terms.c.conf_id) & (other.c.key == conf_terms.c.key)
+            & _matches(other, field, value, prefix)))
+    matched: Dict[str, Set[str]] = {}
+    for row in await database.fetch_all(query):
+        matched.setdefault(row["conf_id"], set()).add(row["key"])
+    await _inherit(database, matched)
+    return {conf_id: sorted(keys) for conf_id, keys in sorted(matched.items())}
+
+
+def _matches(terms, field: str, value: str, prefix: bool):
+    condition = terms.c.field == field
+    if prefix:
+        #  a range, so that the (field, value) index is used
+        return condition & (terms.c.value >= value) & (terms.c.value < value + "\U0010ffff")
+    return condition & (terms.c.value == value)
+
+
+async def _inherit(database: databases.Database, matched: Dict[str, Set[str]]):
+    """Add the matching nodes overlays take from their parents, level by level"""
+    frontier = dict(matched)
+    while frontier:
+        children = await _children(database, list(frontier))
+        if not children:
+            return
+        #  the nodes an overlay overrides have rows of their own
+        overridden: Dict[str, Set[str]] = {}
+        ids = [child for child, _ in children]
+        for start in range(0, len(ids), CHUNK):
+            query = sqlalchemy.select([conf_terms.c.conf_id, conf_terms.c.key]).distinct().where(
+                conf_terms.c.conf_id.in_(ids[start:start + CHUNK]))
+            for row in await database.fetch_all(query):
+                overridden.setdefault(row["conf_id"], set()).add(row["key"])
+        previous, frontier = frontier, {}
+        for child, parent in children:
+            keys = matched.get(child, set())
+            new = previous[parent] - overridden.get(child, set()) - keys
+            if new:
+                matched[child] = keys | new
+                frontier[child] = frontier.get(child, set()) | new
+
+
+async def _children(database: databases.Database, parents: List[str]) -> List[Tuple[str, str]]:
+    """(overlay, parent) pairs of overlays of the parents"""
+    if len(parents) > CHUNK:
+        #  cheaper than many IN (...) queries: all overlays, picked here
+        wanted = set(parents)
+        query = sqlalchemy.select([confs.c.id, confs.c.parent]).where(confs.c.parent.isnot(None))
+        return [(row["id"], row["parent"]) for row in await database.fetch_all(query) if row["parent"] in wanted]
+    query = sqlalchemy.select([confs.c.id, confs.c.parent]).where(confs.c.parent.in_(parents))
+    return [(row["id"], row["parent"]) for row in await database.fetch_all(query)]
@@ -0,0 +1,590 @@
+import asyncio
+import weakref
+
+from collections import OrderedDict
+
+from typing import Optional, Dict, Iterable, Any, List, Tuple, Union
+
+import json
+import logging
+import time
+
+import databases
+import sqlalchemy
+
+from models.conf import Conf, build_node, split_key
+from models.nodes import Node
+from models.overlay import Overlay, merge_attrs
+from models.validation import canonical_json, node_digest
+from models.intern import node_pool
+
+from .changes import ChangeCounter
+from .meta import confs, conf_nodes, conf_terms
+from .search import node_terms, term_rows
+from . import history
+
+
+logger = logging.getLogger(__name__)
+
+
+class RevisionConflict(Exception):
+    """The stored revision of a conf is not the one a write was based on"""
+
+    def __init__(self, conf_id: str, expected: int, stored: Optional[int]):
+        self.conf_id = conf_id
+        self.expected = expected
+        self.stored = stored
+        super().__init__(f"{conf_id} is at revision {stored}, not {expected}")
+
+
+def node_row(conf_id: str, key: str, node: Node, attrs: Optional[str] = None) -> dict:
+    return dict(
+        conf_id=conf_id,
+        key=key,
+        role=node.role.value,
+        name=node.name,
+        type=str(node.type),
+        attrs=attrs if attrs is not None else canonical_json(node.dict()),
+    )
+
+
+class ConfStore:
+    """Confs persisted in the database, with parsed Conf objects of recently
+    used ones kept in an LRU bounded by number of confs and of nodes.
+
+    Confs are loaded on first use, so startup does not parse anything.
+    Overlay confs store only their overrides; their effective conf is
+    resolved on use and kept until the parent's revision moves.
+
+    Several processes may share the database. Call sync() before serving a
+    request: it drops the parsed confs another process changed. With a
+    `counter` shared by the processes it costs no query unless something
+    changed; without one it checks the database at most every
+    `sync_interval` seconds.
+
+    Writes given an `expected` revision compare it with the stored one and
+    change the conf in the same transaction, or raise RevisionConflict.
+    Writers of one conf in a process queue on writing(conf_id); writers of
+    other confs do not wait for them.
+    """
+
+    def __init__(self, database: databases.Database, max_confs: int = 256, max_nodes: int = 200000,
+            counter: Optional[ChangeCounter] = None, sync_interval: float = 0.0,
+            search_fields: Optional[Iterable[str]] = None):
+        self.database = database
+        self.max_confs = max_confs
+        self.max_nodes = max_nodes
+        self.counter = counter
+        self.sync_interval = sync_interval
+        #  fields indexed for search besides role, name and type (see search.node_terms), None for all
+        self.search_fields = set(search_fields) if search_fields else None
+        self._seen = counter.value() if counter is not None else 0
+        self._synced_at = 0.0
+        self._hot: "OrderedDict[str, Conf]" = OrderedDict()
+        #  node counts as they were when the conf was remembered
+        self._sizes: Dict[str, int] = {}
+        self._hot_nodes = 0
+        #  overlay confs in the LRU: (overrides, own revision), and the parent
+        #  revision their effective conf was resolved at
+        self._overlays: Dict[str, Tuple[Overlay, int]] = {}
+        self._bases: Dict[str, int] = {}
+        self._writers: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def writing(self, conf_id: str) -> asyncio.Lock:
+        """Lock to hold from reading a conf to storing changes made to it"""
+        lock = self._writers.get(conf_id)
+        if lock is None:
+            lock = self._writers[conf_id] = asyncio.Lock()
+        return lock
+
+    async def sync(self) -> List[str]:
+        """Forget parsed confs whose stored revision moved, or which were
+        deleted, since they were loaded. Returns their ids."""
+        if self.counter is not None:
+            seen = self.counter.value()
+            if seen == self._seen:
+                return []
+        else:
+            seen = 0
+            now = time.monotonic()
+            if now - self._synced_at < self.sync_interval:
+                return []
+            self._synced_at = now
+        loaded = {conf_id: self._loaded_revision(conf_id) for conf_id in self._hot}
+        stored = await self.revisions(loaded)
+        stale = [conf_id for conf_id, revision in loaded.items() if stored.get(conf_id) != revision]
+        for conf_id in stale:
+            self.forget(conf_id)
+        self.stale += len(stale)
+        if stale:
+            logger.debug("dropped %d confs changed elsewhere", len(stale), extra={"confs": stale})
+        #  changes made while querying bumped the counter past `seen`
+        self._seen = seen
+        return stale
+
+    def _loaded_revision(self, conf_id: str) -> int:
+        """The revision stored for conf_id when it was loaded or saved here"""
+        if conf_id in self._overlays:
+            return self._overlays[conf_id][1]
+        return self._hot[conf_id].revision
+
+    async def get(self, conf_id: str, _chain: Tuple[str, ...] = ()) -> Optional[Conf]:
+        """The conf; for an overlay, the effective conf resolved over its parent"""
+        conf = self._hot.get(conf_id)
+        if conf is not None and conf_id not in self._overlays:
+            self.hits += 1
+            self._hot.move_to_end(conf_id)
+            return conf
+        if conf is None and conf_id not in self._overlays:
+            self.misses += 1
+            row = await self.database.fetch_one(confs.select().where(confs.c.id == conf_id))
+            if row is None:
+                return None
+            if row["parent"] is None:
+                conf = await self._load(conf_id, row["revision"])
+                self._remember(conf_id, conf)
+                return conf
+            overlay = Overlay(parent=row["parent"], nodes=json.loads(row["overlay"] or "{}"))
+            self._overlays[conf_id] = (overlay, row["revision"])
+        return await self._resolve(conf_id, _chain)
+
+    async def _resolve(self, conf_id: str, chain: Tuple[str, ...]) -> Conf:
+        overlay, revision = self._overlays[conf_id]
+        if conf_id in chain:
+            raise ValueError(f"Overlay cycle: {' -> '.join(chain + (conf_id,))}")
+        parent = await self.get(overlay.parent, chain + (conf_id,))
+        if parent is None:
+            raise ValueError(f"No parent conf {overlay.parent} for {conf_id}")
+        conf = self._hot.get(conf_id)
+        if conf is not None and self._bases.get(conf_id) == parent.revision:
+            self.hits += 1
+            self._hot.move_to_end(conf_id)
+            return conf
+        #  new, or the parent changed since it was resolved
+        self.misses += 1
+        conf = overlay.resolve(parent)
+        conf.revision = revision + parent.revision
+        self._remember(conf_id, conf)
+        #  kept after _remember, which forgets what was known about conf_id
+        self._overlays[conf_id] = (overlay, revision)
+        self._bases[conf_id] = parent.revision
+        return conf
+
+    async def overlay(self, conf_id: str) -> Optional[Overlay]:
+        """Overrides of an overlay conf, None for a full conf"""
+        if conf_id not in self._overlays and await self.get(conf_id) is None:
+            return None
+        entry = self._overlays.get(conf_id)
+        return entry[0] if entry is not None else None
+
+    async def children(self, conf_id: str) -> List[str]:
+        """Overlays which have conf_id as their parent"""
+        rows = await self.database.fetch_all(
+            confs.select().with_only_columns([confs.c.id]).where(confs.c.parent == conf_id))
+        return [row["id"] for row in rows]
+
+    async def save_overlay(self, conf_id: str, overlay: Overlay, revision: int,
+            expected: Optional[int] = None) -> Conf:
+        """Store an overlay conf, replacing what was stored under conf_id.
+        Returns its effective conf."""
+        chain, parent = [conf_id], overlay.parent
+        while parent is not None:
+            if parent in chain:
+                raise ValueError(f"Overlay cycle: {' -> '.join(chain + [parent])}")
+            chain.append(parent)
+            parent = await self.database.fetch_val(
+                confs.select().with_only_columns([confs.c.parent]).where(confs.c.id == parent))
+        #  validates the overrides before anything is stored
+        self._overlays[conf_id] = (overlay, revision)
+        self._bases.pop(conf_id, None)
+        try:
+            conf = await self._resolve(conf_id, ())
+        except Exception:
+            self.forget(conf_id)
+            raise
+        try:
+            async with self.database.transaction():
+                stored, _ = await self._upsert_conf(
+                    conf_id, revision, expected, parent=overlay.parent, overlay=json.dumps(overlay.nodes))
+                await self.database.execute(conf_nodes.delete().where(conf_nodes.c.conf_id == conf_id))
+                await self._index(conf_id, {key: conf.get(key) for key in overlay.nodes}, everything=True)
+                await self._index_overlays(conf_id, {node.get_key(): node for node in conf}, everything=True)
+                await history.append_overlay(self.database, conf_id, stored, overlay.parent, overlay.nodes)
+        except BaseException:
+            #  the overrides are kept for conf_id, but not stored
+            self.forget(conf_id)
+            raise
+        self._overlays[conf_id] = (overlay, stored)
+        #  resolved before the revision stored was known
+        conf.revision = stored + self._bases[conf_id]
+        self._changed()
+        return conf
+
+    async def exists(self, conf_id: str) -> bool:
+        if conf_id in self._hot:
+            return True
+        return await self.revision(conf_id) is not None
+
+    async def revision(self, conf_id: str) -> Optional[int]:
+        query = confs.select().with_only_columns([confs.c.revision]).where(confs.c.id == conf_id)
+        return await self.database.fetch_val(query)
+
+    async def effective_revision(self, conf_id: str) -> Optional[int]:
+        """Revision of the conf, plus that of its parents for an overlay"""
+        _, effective = await self.current_revisions(conf_id)
+        return effective
+
+    async def current_revisions(self, conf_id: str) -> Tuple[Optional[int], Optional[int]]:
+        """Stored and effective revision of the conf, from the same reads"""
+        stored, total, current, seen = None, 0, conf_id, set()
+        while current is not None and current not in seen:
+            seen.add(current)
+            row = await self.database.fetch_one(
+                confs.select().with_only_columns([confs.c.revision, confs.c.parent]).where(confs.c.id == current))
+            if row is None:
+                return (None, None) if current == conf_id else (stored, total)
+            if current == conf_id:
+                stored = row["revision"]
+            total += row["revision"]
+            current = row["parent"]
+        return stored, total
+
+    async def revisions(self, conf_ids: Iterable[str], chunk: int = 500) -> Dict[str, int]:
+        """Stored revisions of those of the confs which exist"""
+        conf_ids = list(conf_ids)
+        stored = {}
+        for start in range(0, len(conf_ids), chunk):
+            query = confs.select().with_only_columns([confs.c.id, confs.c.revision]).where(
+                confs.c.id.in_(conf_ids[start:start + chunk]))
+            stored.update((row["id"], row["revision"]) for row in await self.database.fetch_all(query))
+        return stored
+
+    async def chain(self, conf_id: str) -> List[str]:
+        """The conf and, for an overlay, its parents up to a full conf"""
+        chain, current = [], conf_id
+        while current is not None and current not in chain:
+            chain.append(current)
+            if current in self._overlays:
+                current = self._overlays[current][0].parent
+            elif current in self._hot:
+                current = None
+            else:
+                current = await self.database.fetch_val(
+                    confs.select().with_only_columns([confs.c.parent]).where(confs.c.id == current))
+        return chain
+
+    async def count(self) -> int:
+        return await self.database.fetch_val(sqlalchemy.select([sqlalchemy.func.count()]).select_from(confs))
+
+    async def ids(self) -> Iterable[str]:
+        rows = await self.database.fetch_all(confs.select().with_only_columns([confs.c.id]).order_by(confs.c.id))
+        return [row["id"] for row in rows]
+
+    async def save(self, conf_id: str, conf: Conf, encoded: Optional[Dict[str, str]] = None,
+            expected: Optional[int] = None):
+        """Store the whole conf, replacing what was stored under conf_id.
+        `encoded` may hold attrs of nodes already dumped to JSON, by key"""
+        async with self.database.transaction():
+            await self._replace(conf_id, conf, encoded, expected)
+        self._remember(conf_id, conf)
+        self._changed()
+
+    async def save_many(self, saved: Iterable[Tuple[str, Conf, Optional[Dict[str, str]]]]):
+        """Store several whole confs, as save() does, in one transaction.
+        They are not kept in memory: a bulk load would flush the LRU."""
+        saved = list(saved)
+        async with self.database.transaction():
+            for conf_id, conf, encoded in saved:
+                await self._replace(conf_id, conf, encoded)
+        for conf_id, _, _ in saved:
+            self.forget(conf_id)
+        self._changed()
+
+    async def _replace(self, conf_id: str, conf: Conf, encoded: Optional[Dict[str, str]] = None,
+            expected: Optional[int] = None):
+        encoded = encoded or {}
+        conf.revision, _ = await self._upsert_conf(conf_id, conf.revision, expected, parent=None, overlay=None)
+        query = conf_nodes.select().with_only_columns([conf_nodes.c.key, conf_nodes.c.attrs]).where(
+            conf_nodes.c.conf_id == conf_id).order_by(conf_nodes.c.id)
+        old = OrderedDict((row["key"], row["attrs"]) for row in await self.database.fetch_all(query))
+        rows = []
+        for node in conf:
+            key = node.get_key()
+            rows.append(node_row(conf_id, key, node, encoded.get(key)))
+        keys = [row["key"] for row in rows]
+        changed = [row for row in rows if old.get(row["key"]) != row["attrs"]]
+        removed = list(old.keys() - set(keys))
+        if old and history.applied_order(list(old), [row["key"] for row in changed], removed) == keys:
+            #  same order of nodes (e.g. a conf loaded again with a few
+            #  edits, or rolled back): only the rows which differ are written
+            await self._store_nodes(conf_id, removed, changed)
+            await self._log(conf_id, conf.revision, removed, changed)
+            nodes = {row["key"]: conf.get(row["key"]) for row in changed}
+            nodes.update((key, None) for key in removed)
+            await self._index(conf_id, nodes)
+            await self._index_overlays(conf_id, nodes)
+            return
+        await self.database.execute(conf_nodes.delete().where(conf_nodes.c.conf_id == conf_id))
+        if rows:
+            await self.database.execute_many(conf_nodes.insert(), rows)
+        await self._log(conf_id, conf.revision, removed, changed, order=keys)
+        nodes = {node.get_key(): node for node in conf}
+        await self._index(conf_id, nodes, everything=True)
+        await self._index_overlays(conf_id, nodes, everything=True)
+
+    async def save_changes(self, conf_id: str, conf: Conf, changes: Dict[str, Optional[Node]],
+            base: int, expected: Optional[int] = None):
+        """Store the changed nodes of a full conf (None for removed ones), see Conf.apply.
+        `base` is the revision of the conf the changes were made to."""
+        if conf_id in self._overlays:
+            raise ValueError(f"{conf_id} is an overlay, its nodes are changed with its overrides")
+        removed = [key for key, node in changes.items() if node is None]
+        changed = {key: node for key, node in changes.items() if node is not None}
+        try:
+            async with self.database.transaction():
+                conf.revision, before = await self._upsert_conf(conf_id, conf.revision, expected)
+                rows = [node_row(conf_id, key, node) for key, node in changed.items()]
+                await self._store_nodes(conf_id, removed, rows)
+                await self._log(conf_id, conf.revision, removed, rows)
+                await self._index(conf_id, changes)
+                await self._index_overlays(conf_id, changes)
+        except BaseException:
+            #  the changes were made to the conf in memory, and are not stored
+            self.forget(conf_id)
+            raise
+        self._remember(conf_id, conf)
+        if before != base:
+            #  written over changes made by another process, which this conf lacks
+            self.forget(conf_id)
+        self._changed()
+
+    async def _store_nodes(self, conf_id: str, removed: List[str], rows: List[dict]):
+        """Delete the removed nodes, update the rows of changed nodes in place
+        and add those of new ones, see node_row"""
+        if removed:
+            await self.database.execute(conf_nodes.delete().where(
+                (conf_nodes.c.conf_id == conf_id) & conf_nodes.c.key.in_(removed)))
+        if rows:
+            query = conf_nodes.select().with_only_columns([conf_nodes.c.key]).where(
+                (conf_nodes.c.conf_id == conf_id) & conf_nodes.c.key.in_([row["key"] for row in rows]))
+            existing = {row["key"] for row in await self.database.fetch_all(query)}
+            for row in rows:
+                if row["key"] in existing:
+                    await self.database.execute(conf_nodes.update().where(
+                        (conf_nodes.c.conf_id == conf_id) & (conf_nodes.c.key == row["key"])).values(**row))
+            added = [row for row in rows if row["key"] not in existing]
+            if added:
+                await self.database.execute_many(conf_nodes.insert(), added)
+
+    async def _log(self, conf_id: str, revision: int, removed: List[str], rows: List[dict],
+            order: Optional[List[str]] = None):
+        """Add a revision to the history of a full conf, from the rows of
+        its changed nodes, once they are stored"""
+        async def snapshot():
+            query = conf_nodes.select().with_only_columns([conf_nodes.c.key, conf_nodes.c.attrs]).where(
+                conf_nodes.c.conf_id == conf_id).order_by(conf_nodes.c.id)
+            return history.snapshot_body((row["key"], row["attrs"]) for row in await self.database.fetch_all(query))
+
+        delta = history.delta_body(((row["key"], row["attrs"]) for row in rows), removed, order)
+        await history.append(self.database, conf_id, revision, delta, snapshot)
+
+    async def revision_log(self, conf_id: str) -> List[Dict[str, Any]]:
+        """Logged revisions of the conf, latest first (see history.py)"""
+        return await history.entries(self.database, conf_id)
+
+    async def at_revision(self, conf_id: str, revision: int) -> Union[Conf, Overlay, None]:
+        """The conf, or the overrides of an overlay, as they were at a logged revision"""
+        logged = await history.rebuild(self.database, conf_id, revision)
+        if logged is None:
+            return None
+        kind, state = logged
+        if kind == history.OVERLAY:
+            return Overlay(**state)
+        conf = Conf()
+        for key, attrs in state.items():
+            role, name = split_key(key)
+            conf.add(build_node(role, name, attrs, trusted=True))
+        conf.revision = revision
+        return conf
+
+    async def _index(self, conf_id: str, nodes: Dict[str, Optional[Node]], everything: bool = False):
+        """Replace the search terms of the nodes (None for removed ones), or
+        with `everything`, all terms of the conf"""
+        if everything:
+            await self.database.execute(conf_terms.delete().where(conf_terms.c.conf_id == conf_id))
+        elif nodes:
+            await self.database.execute(conf_terms.delete().where(
+                (conf_terms.c.conf_id == conf_id) & conf_terms.c.key.in_(list(nodes))))
+        rows = []
+        for key, node in nodes.items():
+            if node is not None:
+                rows.extend(term_rows(conf_id, key, node, self.search_fields))
+        await self._insert_terms(rows)
+
+    async def _insert_terms(self, rows: List[dict], chunk: int = 150):
+        #  many rows per statement: there are about ten times as many terms as nodes
+        #  (150 rows of 4 values stay below the 999 parameters older SQLite allow)
+        for start in range(0, len(rows), chunk):
+            await self.database.execute(conf_terms.insert().values(rows[start:start + chunk]))
+
+    async def _index_overlays(self, conf_id: str, nodes: Dict[str, Optional[Node]], everything: bool = False):
+        """Reindex the nodes overlays of conf_id override, after its effective
+        `nodes` (None for removed ones; with `everything`, all of them) changed"""
+        query = confs.select().with_only_columns([confs.c.id, confs.c.overlay]).where(confs.c.parent == conf_id)
+        for row in await self.database.fetch_all(query):
+            overrides = json.loads(row["overlay"] or "{}")
+            keys = set(nodes) | set(overrides) if everything else set(nodes)
+            effective: Dict[str, Optional[Node]] = {}
+            for key in keys:
+                override = overrides.get(key)
+                node = nodes.get(key)
+                if override is None:
+                    #  taken from the parent as it is
+                    effective[key] = node
+                    continue
+                #  as Overlay.resolve builds it
+                role, name = split_key(key)
+                attrs = merge_attrs(node.dict(), override) if node is not None else override
+                try:
+                    effective[key] = build_node(role, name, attrs)
+                except ValueError:
+                    #  broken by the change, it matches nothing until fixed
+                    effective[key] = None
+            await self._index(row["id"], {key: effective[key] for key in keys if key in overrides})
+            await self._index_overlays(row["id"], effective, everything)
+
+    async def ensure_index(self, chunk: int = 500):
+        """Build the search index of stored confs if there is none (e.g. the
+        table is new), from the stored nodes and overlays"""
+        if await self.database.fetch_val(sqlalchemy.select([conf_terms.c.id]).limit(1)) is not None:
+            return
+        if await self.database.fetch_val(sqlalchemy.select([conf_nodes.c.id]).limit(1)) is None:
+            return
+        rows = await self.database.fetch_all(confs.select().with_only_columns([confs.c.id, confs.c.parent]))
+        full = [row["id"] for row in rows if row["parent"] is None]
+        for start in range(0, len(full), chunk):
+            conf_ids = full[start:start + chunk]
+            query = conf_nodes.select().where(conf_nodes.c.conf_id.in_(conf_ids))
+            terms = []
+            for row in await self.database.fetch_all(query):
+                terms.extend(
+                    dict(conf_id=row["conf_id"], key=row["key"], field=field, value=value)
+                    for field, value in node_terms(row["role"], row["name"], json.loads(row["attrs"]),
+                                                   self.search_fields))
+            async with self.database.transaction():
+                await self.database.execute(conf_terms.delete().where(conf_terms.c.conf_id.in_(conf_ids)))
+                await self._insert_terms(terms)
+        for row in rows:
+            if row["parent"] is None:
+                continue
+            try:
+                conf = await self.get(row["id"])
+            except ValueError:
+                #  broken overlay chain, indexed when fixed
+                continue
+            overlay = await self.overlay(row["id"])
+            async with self.database.transaction():
+                await self._index(row["id"], {key: conf.get(key) for key in overlay.nodes}, everything=True)
+
+    def _changed(self):
+        """Tell other processes, once the change is committed"""
+        if self.counter is not None:
+            self.counter.bump()
+
+    def forget(self, conf_id: str):
+        if self._hot.pop(conf_id, None) is not None:
+            self._hot_nodes -= self._sizes.pop(conf_id)
+        self._overlays.pop(conf_id, None)
+        self._bases.pop(conf_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Parsed confs in the LRU, their nodes, and how often the LRU served a conf"""
+        return dict(confs=len(self._hot), nodes=self._hot_nodes, hits=self.hits, misses=self.misses, stale=self.stale)
+
+    def memory(self) -> Dict[str, Any]:
+        """Memory taken by parsed confs in the LRU, per conf and in total.
+
+        `bytes` of a conf counts its nodes as if it held them alone,
+        `own_bytes` only the nodes no other conf in memory shares.
+        """
+        users: Dict[str, int] = {}
+        digests = {}
+        for conf_id, conf in self._hot.items():
+            digests[conf_id] = {conf.digest(key) for key in conf.keys()}
+            for digest in digests[conf_id]:
+                users[digest] = users.get(digest, 0) + 1
+        per_conf = {}
+        for conf_id, conf in self._hot.items():
+            own = [d for d in digests[conf_id] if users[d] == 1]
+            per_conf[conf_id] = dict(
+                conf.memory(),
+                shared=len(digests[conf_id]) - len(own),
+                own_bytes=sum(node_pool.size_of(d) for d in own),
+            )
+        logical = sum(c["bytes"] for c in per_conf.values())
+        stored = sum(node_pool.size_of(d) for d in users)
+        return dict(
+            confs=per_conf,
+            total=dict(
+                confs=len(per_conf),
+                nodes=sum(c["nodes"] for c in per_conf.values()),
+                unique=len(users),
+                bytes=stored,
+                bytes_unshared=logical,
+                pool=node_pool.stats(),
+            ),
+        )
+
+    async def _check_revision(self, conf_id: str, expected: Optional[int]) -> Optional[int]:
+        """The stored revision of conf_id, with the row locked until the end of
+        the transaction. Raises RevisionConflict if it is not `expected`."""
+        #  written before it is read: SQLite fails at once, rather than waits,
+        #  when two transactions which both read try to write
+        await self.database.execute(
+            confs.update().where(confs.c.id == conf_id).values(revision=confs.c.revision))
+        stored = await self.revision(conf_id)
+        if expected is not None and stored != expected:
+            raise RevisionConflict(conf_id, expected, stored)
+        return stored
+
+    async def _upsert_conf(self, conf_id: str, revision: int, expected: Optional[int] = None,
+            **values) -> Tuple[int, Optional[int]]:
+        """Returns the revision stored now and the one stored before"""
+        before = await self._check_revision(conf_id, expected)
+        if before is None:
+            await self.database.execute(confs.insert().values(id=conf_id, revision=revision, **values))
+            return revision, before
+        #  revisions never go back, even if two writes finish out of order,
+        #  and each write has its own (see history.py). That of an overlay
+        #  adds its parents' (see effective_revision): it moves past the
+        #  effective revision stored before, whatever the new parent's.
+        parent = values.get("parent")
+        base = (await self.effective_revision(parent) or 0) if parent is not None else 0
+        revision = max(before + 1, revision, await self.effective_revision(conf_id) - base + 1)
+        await self.database.execute(confs.update().where(confs.c.id == conf_id).values(revision=revision, **values))
+        return revision, before
+
+    async def _load(self, conf_id: str, revision: int) -> Conf:
+        query = conf_nodes.select().where(conf_nodes.c.conf_id == conf_id).order_by(conf_nodes.c.id)
+        conf = Conf()
+        for row in await self.database.fetch_all(query):
+            #  stored attrs come from valid nodes, as canonical JSON
+            digest = node_digest(row["role"], row["name"], canonical=row["attrs"])
+            conf.add(build_node(row["role"], row["name"], json.loads(row["attrs"]), trusted=True, digest=digest))
+        conf.revision = revision
+        return conf
+
+    def _remember(self, conf_id: str, conf: Conf):
+        self.forget(conf_id)
+        self._hot[conf_id] = conf
+        self._sizes[conf_id] = len(conf)
+        self._hot_nodes += len(conf)
+        #  evict least recently used, but never the conf just used
+        while len(self._hot) > 1 and (len(self._hot) > self.max_confs or self._hot_nodes > self.max_nodes):
+            evicted, _ = self._hot.popitem(last=False)
+            self._hot_nodes -= self._sizes.pop(evicted)
+            self._overlays.pop(evicted, None)
+            self._bases.pop(evicted, None)
@@ -0,0 +1,213 @@
+"""Render confs for an Ansible inventory and push them to the hosts.
+
+Each host gets the conf named by its `vector_conf_id` host variable (or
+the conf named like the host, or --conf). Distinct confs are rendered
+once, in parallel worker processes, and the playbook copies a file only
+to hosts where its sha1 differs from the file already there.
+
+    python -m deploy.fleet -i deploy/inventory.local.yml --forks 20
+
+deploy/inventory.local.yml uses `ansible_connection: local`, to try it all
+on one machine.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from typing import Optional, List, Dict, Any, NamedTuple, Tuple
+
+import databases
+
+from db.meta import ensure_schemas
+from db.store import ConfStore
+from models.usertypes import node_subclass_registry
+from settings import get_settings
+from workers import ConfWorkers
+
+
+PLAYBOOK = """\
+- hosts: all
+  gather_facts: false
+  vars:
+    vector_conf_path: "{{ vector_conf_dest | default(vector_conf_default_dest) }}"
+  tasks:
+    - name: Check the Vector config on the host
+      stat:
+        path: "{{ vector_conf_path }}"
+        checksum_algorithm: sha1
+      register: vector_conf_stat
+
+    - name: Create the Vector config directory
+      file:
+        path: "{{ vector_conf_path | dirname }}"
+        state: directory
+      when: vector_conf_stat.stat.checksum | default('') != vector_conf_sha1
+
+    - name: Upload the Vector config
+      copy:
+        src: "{{ vector_conf_src }}"
+        dest: "{{ vector_conf_path }}"
+        mode: "0644"
+      when: vector_conf_stat.stat.checksum | default('') != vector_conf_sha1
+      notify: reload vector
+
+  handlers:
+    - name: reload vector
+      command: "{{ vector_reload_command }}"
+      when: vector_reload_command | default('') | length > 0
+"""
+
+
+class HostConf(NamedTuple):
+    host: str
+    conf_id: str
+    src: str
+    sha1: str
+
+
+def inventory_hosts(inventory: str) -> Dict[str, Dict[str, Any]]:
+    """Variables of every host of the inventory, by host name"""
+    output = subprocess.run(
+        ["ansible-inventory", "-i", inventory, "--list"],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    data = json.loads(output)
+    hostvars = data.get("_meta", {}).get("hostvars", {})
+    hosts = {}
+    for name, group in data.items():
+        if name == "_meta":
+            continue
+        for host in group.get("hosts", ()):
+            hosts[host] = hostvars.get(host, {})
+    for host, variables in hostvars.items():
+        hosts.setdefault(host, variables)
+    return hosts
+
+
+def conf_id_for(host: str, variables: Dict[str, Any], known: set, default: Optional[str]) -> Optional[str]:
+    if "vector_conf_id" in variables:
+        return variables["vector_conf_id"]
+    if host in known:
+        return host
+    return default
+
+
+async def render_fleet(store: ConfStore, workers: ConfWorkers, hosts: Dict[str, Dict[str, Any]],
+        staging: str, default: Optional[str] = None) -> Tuple[List[HostConf], Dict[str, str]]:
+    """Render the conf of every host into `staging`, one file per distinct conf.
+    Returns the rendered hosts and errors by host."""
+    known = set(await store.ids())
+    wanted: Dict[str, List[str]] = {}
+    errors = {}
+    for host, variables in sorted(hosts.items()):
+        conf_id = conf_id_for(host, variables, known, default)
+        if conf_id is None:
+            errors[host] = "no vector_conf_id and no conf named like the host"
+        else:
+            wanted.setdefault(conf_id, []).append(host)
+
+    async def render(conf_id: str):
+        conf = await store.get(conf_id)
+        if conf is None:
+            raise ValueError(f"No such conf: {conf_id}")
+        return (await workers.render(conf)).text
+
+    os.makedirs(os.path.join(staging, "confs"), exist_ok=True)
+    results = await asyncio.gather(*(render(conf_id) for conf_id in wanted), return_exceptions=True)
+    rendered = []
+    for (conf_id, conf_hosts), result in zip(wanted.items(), results):
+        if isinstance(result, Exception):
+            errors.update((host, str(result)) for host in conf_hosts)
+            continue
+        data = result.encode("utf-8")
+        sha1 = hashlib.sha1(data).hexdigest()
+        src = os.path.join(staging, "confs", f"{sha1}.toml")
+        with open(src, "wb") as f:
+            f.write(data)
+        rendered.extend(HostConf(host, conf_id, src, sha1) for host in conf_hosts)
+    return rendered, errors
+
+
+def write_playbook(staging: str, rendered: List[HostConf]) -> str:
+    """Playbook and host_vars next to it, which Ansible picks up by itself"""
+    host_vars = os.path.join(staging, "host_vars")
+    os.makedirs(host_vars, exist_ok=True)
+    for item in rendered:
+        with open(os.path.join(host_vars, f"{item.host}.json"), "w") as f:
+            json.dump(dict(vector_conf_id=item.conf_id, vector_conf_src=item.src, vector_conf_sha1=item.sha1), f)
+    playbook = os.path.join(staging, "vector_conf.yml")
+    with open(playbook, "w") as f:
+        f.write(PLAYBOOK)
+    return playbook
+
+
+def run_playbook(inventory: str, playbook: str, hosts: List[str], forks: int,
+        extra_vars: Dict[str, Any], check: bool = False) -> int:
+    command = [
+        "ansible-playbook", "-i", inventory, playbook,
+        "--forks", str(forks),
+        "--limit", ",".join(hosts),
+        "--extra-vars", json.dumps(extra_vars),
+    ]
+    if check:
+        command.append("--check")
+    return subprocess.run(command).returncode
+
+
+async def deploy(args) -> int:
+    settings = get_settings()
+    node_subclass_registry.configure(settings.plugin_dirs())
+    ensure_schemas(settings.database_url)
+    database = databases.Database(settings.database_url)
+    store = ConfStore(database, max_confs=settings.hot_confs, max_nodes=settings.hot_nodes)
+    #  everything goes to the workers: rendering is all this process does
+    workers = ConfWorkers(processes=args.workers, timeout=settings.worker_timeout, inline_nodes=0,
+                          plugin_dirs=settings.plugin_dirs())
+    hosts = inventory_hosts(args.inventory)
+    staging = args.staging or tempfile.mkdtemp(prefix="vector-fleet-")
+    await database.connect()
+    workers.start()
+    try:
+        rendered, errors = await render_fleet(store, workers, hosts, staging, args.conf)
+    finally:
+        workers.shutdown()
+        await database.disconnect()
+
+    for host, error in sorted(errors.items()):
+        print(f"{host}: {error}", file=sys.stderr)
+    print(f"Rendered {len({r.sha1 for r in rendered})} distinct confs for {len(rendered)} hosts into {staging}",
+          file=sys.stderr)
+    if not rendered or args.render_only:
+        return 1 if errors else 0
+
+    playbook = write_playbook(staging, rendered)
+    extra_vars = dict(vector_conf_default_dest=args.dest)
+    if args.reload_command:
+        extra_vars["vector_reload_command"] = args.reload_command
+    code = run_playbook(args.inventory, playbook, [r.host for r in rendered], args.forks, extra_vars, args.check)
+    return code or (1 if errors else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-i", "--inventory", required=True, help="Ansible inventory")
+    parser.add_argument("--conf", help="conf for hosts with no vector_conf_id and no conf named like them")
+    parser.add_argument("--dest", default="/etc/vector/vector.toml",
+                        help="path of the config on the hosts (host variable vector_conf_dest wins)")
+    parser.add_argument("--forks", type=int, default=20, help="parallel Ansible connections")
+    parser.add_argument("--workers", type=int, default=None, help="rendering processes, one per CPU by default")
+    parser.add_argument("--staging", help="directory for rendered files and the playbook, a new temporary one by default")
+    parser.add_argument("--reload-command", help="run on hosts whose config changed, e.g. 'systemctl reload vector'")
+    parser.add_argument("--check", action="store_true", help="run the playbook in check mode")
+    parser.add_argument("--render-only", action="store_true", help="render, do not run Ansible")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(deploy(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Logging setup: level and format come from the settings"""
+
+import json
+import logging
+
+#  loggers of this app; the level applies to them, libraries log warnings and up
+APP_LOGGERS = ("main", "models", "db", "workers", "watch", "bulk", "deploy")
+
+#  attributes every LogRecord has; the others were passed in `extra`
+STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the `extra` fields of the log call"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(
+            time=self.formatTime(record),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+        )
+        entry.update((k, v) for k, v in vars(record).items() if k not in STANDARD_ATTRS)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "WARNING", fmt: str = "text"):
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.WARNING)
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(level.upper())
@@ -1,4 +1,4 @@
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Dict, Iterable, Iterator, Mapping, Any, Tuple, NamedTuple
 
 from pydantic import \
     BaseModel, \
@@ -10,6 +10,7 @@ from pydantic import \
 
 from .usertypes import \
     NodeRole, \
+    NodeOpKind, \
     FileFingerprintingStrategy, \
     FileMultilineParseMode, \
     FileEncoding, \
@@ -19,45 +20,525 @@ from .usertypes import \
 
 
 from .nodes import Node
+from .validation import node_cache, node_digest
+from .lazy import LazyNode
+from .intern import node_pool
+from .query import sort_value, field_value
+from .topology import TopologyReport, analyze
+from .metrics import metrics
 
+from enum import Enum
+
+import bisect
+import logging
+import re
 import toml
 
-class Conf(BaseModel):
-    items: List[Node] = []
+
+logger = logging.getLogger(__name__)
+
+
+class ConfEncoder(toml.TomlEncoder):
+    """Writes enum members as their values: toml takes a str Enum for an
+    iterable and writes it as a list of characters"""
+
+    def dump_value(self, v):
+        if isinstance(v, Enum):
+            v = v.value
+        return super().dump_value(v)
+
+
+toml_encoder = ConfEncoder()
+
+#  names written in table headers without quotes
+BARE_KEY = re.compile(r"^[A-Za-z0-9_-]+$")
+
+#  order of the sections in TOML text
+SECTIONS = (NodeRole.sources, NodeRole.transforms, NodeRole.sinks)
+
+#  sort orders kept with a conf (see Conf.ordered)
+MAX_ORDERS = 8
+
+#  rendered text kept with a conf up to this many characters: bigger ones
+#  are rendered again, rather than held by every conf in the LRU
+CACHED_TEXT_SIZE = 64 * 1024
+
+
+def render_node(node: Node) -> str:
+    """TOML of one node: its table and the tables of its nested options,
+    as toml.dumps writes them in a whole conf"""
+    name = node.name
+    if not BARE_KEY.match(name):
+        name = toml_encoder.dump_funcs[str](name)
+    sections = {f"{node.role.value}.{name}": node.dict()}
+    parts: List[str] = []
+    while sections:
+        nested = {}
+        for path, table in sections.items():
+            body, tables = toml_encoder.dump_sections(table, path)
+            if body or not tables:
+                if parts:
+                    parts.append("\n")
+                parts.append(f"[{path}]\n")
+                parts.append(body)
+            nested.update((f"{path}.{key}", value) for key, value in tables.items())
+        sections = nested
+    return "".join(parts)
+
+
+def serialize_nodes(nodes: List[Node]) -> Iterator[str]:
+    """TOML of the nodes, a node at a time: sources, transforms, then sinks,
+    each in the order given"""
+    first = True
+    for role in SECTIONS:
+        for node in nodes:
+            if node.role is not role:
+                continue
+            if not first:
+                yield "\n"
+            first = False
+            yield render_node(node)
+
+
+def split_key(key: str) -> Tuple[NodeRole, str]:
+    """Split a node key ("sinks.es_cluster") into role and name"""
+    role, _, name = key.partition(".")
+    if not name:
+        raise ValueError(f"Invalid node key: {key}")
+    return NodeRole(role), name
+
+
+#  set from the key of a node, never from its attributes
+RESERVED_ATTRS = ("name", "role")
+
+
+def build_node(role: Union[NodeRole, str], name: str, attrs: Mapping[str, Any], trusted: bool = False,
+        digest: Optional[str] = None) -> Node:
+    """Validate attrs of a single node and build the model for its role and type.
+
+    A node validated before for the same role, name and attrs is reused.
+    With `trusted`, attrs are taken as produced by Node.dict() of a valid
+    node (e.g. from our own storage): validation is skipped and the node is
+    a LazyNode, which builds its model only when asked for it. `digest` of
+    the attrs may be given when known.
+    """
+    node_r = NodeRole(role)
+    try:
+        node_type = attrs["type"]
+    except KeyError:
+        raise ValueError(f"Node {node_r.value}.{name} has no type")
+    reserved = [field for field in RESERVED_ATTRS if field in attrs]
+    if reserved:
+        raise ValueError(
+            f"Node {node_r.value}.{name}: attributes {', '.join(reserved)} are not allowed, they come from its key")
+    if digest is None:
+        digest = node_digest(node_r.value, name, attrs)
+    model = node_cache.get(digest)
+    if model is not None:
+        return model
+    if trusted:
+        #  attrs of a valid node: the digest is its content address
+        model = node_pool.lookup(digest)
+        if model is None:
+            model = node_pool.intern(LazyNode.stored(node_r, name, attrs), digest)
+    else:
+        model_factory = node_subclass_registry.model_for_role_type(node_r, node_type)
+        started = metrics.start()
+        try:
+            model = model_factory(**attrs, name=name)
+        except TypeError as e:
+            #  arguments the model factory does not take
+            raise ValueError(f"Node {node_r.value}.{name}: {e}")
+        metrics.stop("validate_node", started)
+        model = node_pool.intern(model)
+    node_cache.put(digest, model)
+    return model
+
+
+class NodeOp(BaseModel):
+    "What to do with the node"
+    op: NodeOpKind
+    "Key of the node, e.g. sinks.es_cluster"
+    key: str
+    "Node attributes for add and replace, the changed fields for merge"
+    attrs: Optional[Dict[str, Any]]
+    "New name for rename"
+    name: Optional[str]
+    "On rename, also replace the old name in inputs of consumers"
+    update_inputs: bool = True
+
+
+class ConfPatchError(ValueError):
+    def __init__(self, index: int, op: NodeOp, message: str):
+        self.index = index
+        self.op = op
+        super().__init__(f"Operation #{index} ({op.op.value} {op.key}): {message}")
+
+
+class Rendered(NamedTuple):
+    revision: int
+    text: str
+
+
+class Conf:
+    """Vector config.
+
+    Nodes are kept in insertion order and indexed by key (see Node.get_key),
+    by role, by type and by the input names they consume, so lookups and
+    edits do not scan the whole config.
+    """
+
+    def __init__(self, items: Optional[Iterable[Node]] = None):
+        self._nodes: Dict[str, Node] = {}
+        self._by_role: Dict[str, Dict[str, Node]] = {}
+        self._by_type: Dict[str, Dict[str, Node]] = {}
+        self._by_name: Dict[str, Dict[str, Node]] = {}
+        #  input name -> consumers (transforms and sinks), by key
+        self._consumers: Dict[str, Dict[str, Node]] = {}
+        #  bumped on every change, used to drop derived data (sort orders etc.)
+        self.revision = 0
+        #  field -> (revision, sort values, keys), both ascending
+        self._orders: Dict[str, Tuple[int, List[Any], List[str]]] = {}
+        self._rendered: Optional[Rendered] = None
+        self._topology: Optional[Tuple[int, TopologyReport]] = None
+        for node in items or ():
+            self.add(node)
+
+    @property
+    def items(self) -> List[Node]:
+        return list(self._nodes.values())
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __iter__(self) -> Iterator[Node]:
+        return iter(self._nodes.values())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._nodes
+
+    def get(self, key: str) -> Optional[Node]:
+        return self._nodes.get(key)
+
+    def digest(self, key: str) -> str:
+        """Content hash of the node, equal for equal nodes in any conf"""
+        return node_pool.digest_of(self._nodes[key])
+
+    def memory(self) -> Dict[str, int]:
+        """Nodes, distinct nodes and their approximate size in bytes
+        (interned nodes are shared with other confs)"""
+        digests = {node_pool.digest_of(node) for node in self._nodes.values()}
+        return dict(
+            nodes=len(self._nodes),
+            unique=len(digests),
+            bytes=sum(node_pool.size_of(d) for d in digests),
+        )
+
+    def by_role(self, role: Union[NodeRole, str]) -> List[Node]:
+        return list(self._by_role.get(NodeRole(role).value, {}).values())
+
+    def by_type(self, node_type: str) -> List[Node]:
+        return list(self._by_type.get(node_type, {}).values())
+
+    def keys_named(self, name: str) -> List[str]:
+        """Keys of nodes called `name` (normally one: Vector ids are unique across roles)"""
+        return list(self._by_name.get(name, ()))
+
+    def duplicate_names(self) -> Iterator[Tuple[str, List[str]]]:
+        for name, bucket in self._by_name.items():
+            if len(bucket) > 1:
+                yield name, list(bucket)
+
+    def consumers_of(self, name: str) -> List[Node]:
+        """Nodes which have `name` in their inputs"""
+        return list(self._consumers.get(name, {}).values())
+
+    def add(self, node: Node):
+        node = node_pool.intern(node)
+        key = node.get_key()
+        if key in self._nodes:
+            raise KeyError(f'Node {key} already exists')
+        self._nodes[key] = node
+        self._index(key, node)
+        self.revision += 1
+
+    def put(self, node: Node) -> Optional[Node]:
+        """Add node or replace the node with the same key in place.
+        Returns the replaced node, if any"""
+        node = node_pool.intern(node)
+        key = node.get_key()
+        old = self._nodes.get(key)
+        if old is not None:
+            self._unindex(key, old, replacement=node)
+        self._nodes[key] = node
+        self._index(key, node)
+        self.revision += 1
+        return old
+
+    def remove(self, key: str) -> Node:
+        try:
+            node = self._nodes.pop(key)
+        except KeyError:
+            raise KeyError(f'No such node: {key}')
+        self._unindex(key, node)
+        self.revision += 1
+        return node
+
+    def clear(self):
+        self._nodes.clear()
+        self._by_role.clear()
+        self._by_type.clear()
+        self._by_name.clear()
+        self._consumers.clear()
+        self.revision += 1
+
+    def apply(self, ops: List[NodeOp]) -> Dict[str, Optional[Node]]:
+        """Apply a batch of node operations atomically.
+
+        Only nodes touched by the operations are (re)validated. Either all
+        operations succeed or the conf is left untouched and ConfPatchError
+        is raised. Returns the changed keys with their new nodes (None for
+        removed ones).
+        """
+        staged: Dict[str, Optional[Node]] = {}
+
+        def lookup(key: str) -> Optional[Node]:
+            return staged[key] if key in staged else self._nodes.get(key)
+
+        def taken(name: str) -> Optional[str]:
+            """Key of a node called `name` in any role, staged changes included"""
+            for key in self.keys_named(name):
+                if lookup(key) is not None:
+                    return key
+            for key, node in staged.items():
+                if node is not None and node.name == name:
+                    return key
+            return None
+
+        for index, op in enumerate(ops):
+            try:
+                role, name = split_key(op.key)
+                current = lookup(op.key)
+                if op.op == NodeOpKind.add:
+                    if current is not None:
+                        raise ValueError("node already exists")
+                    other = taken(name)
+                    if other is not None:
+                        #  Vector ids are unique across roles
+                        raise ValueError(f"name {name} is taken by {other}")
+                    staged[op.key] = build_node(role, name, op.attrs or {})
+                    continue
+                if current is None:
+                    raise ValueError("no such node")
+                if op.op == NodeOpKind.replace:
+                    staged[op.key] = build_node(role, name, op.attrs or {})
+                elif op.op == NodeOpKind.merge:
+                    staged[op.key] = build_node(role, name, {**current.dict(), **(op.attrs or {})})
+                elif op.op == NodeOpKind.remove:
+                    staged[op.key] = None
+                elif op.op == NodeOpKind.rename:
+                    if not op.name:
+                        raise ValueError("new name is required")
+                    new_key = f"{role.value}.{op.name}"
+                    other = taken(op.name)
+                    if other is not None:
+                        raise ValueError(f"name {op.name} is taken by {other}")
+                    staged[op.key] = None
+                    staged[new_key] = current.copy(update={"name": op.name})
+                    if op.update_inputs:
+                        self._stage_renamed_input(staged, lookup, name, op.name)
+            except ValueError as e:
+                raise ConfPatchError(index, op, str(e))
+
+        for key, node in staged.items():
+            if node is None:
+                if key in self._nodes:
+                    self.remove(key)
+            else:
+                self.put(node)
+        return staged
+
+    def _stage_renamed_input(self, staged, lookup, old_name: str, new_name: str):
+        consumers = {node.get_key() for node in self.consumers_of(old_name)}
+        consumers.update(
+            key for key, node in staged.items()
+            if node is not None and old_name in (getattr(node, "inputs", None) or ()))
+        for key in consumers:
+            node = lookup(key)
+            if node is None:
+                continue
+            inputs = [new_name if i == old_name else i for i in node.inputs]
+            staged[key] = node.copy(update={"inputs": inputs})
+
+    def keys(self, role: Union[NodeRole, str, None] = None, node_type: Optional[str] = None) -> Iterable[str]:
+        """Node keys in insertion order, optionally narrowed by role and type"""
+        if role is None and node_type is None:
+            return self._nodes.keys()
+        buckets = []
+        if role is not None:
+            buckets.append(self._by_role.get(NodeRole(role).value, {}))
+        if node_type is not None:
+            buckets.append(self._by_type.get(node_type, {}))
+        first, *rest = sorted(buckets, key=len)
+        return [key for key in first if all(key in b for b in rest)]
+
+    def ordered(self, field: str) -> Tuple[List[Any], List[str]]:
+        """Sort values and keys of all nodes, ascending by `field`, then by key.
+        Computed once and reused until the conf changes, for the last
+        MAX_ORDERS fields."""
+        cached = self._orders.get(field)
+        if cached is not None and cached[0] == self.revision:
+            return cached[1], cached[2]
+        #  orders of older revisions are of no use any more
+        self._orders = {f: order for f, order in self._orders.items() if order[0] == self.revision}
+        while len(self._orders) >= MAX_ORDERS:
+            del self._orders[next(iter(self._orders))]
+        pairs = sorted(
+            (sort_value(field_value(node, field)), key)
+            for key, node in self._nodes.items()
+        )
+        values = [v for v, _ in pairs]
+        keys = [k for _, k in pairs]
+        self._orders[field] = (self.revision, values, keys)
+        return values, keys
+
+    def keys_with_prefix(self, field: str, prefix: str) -> List[str]:
+        """Keys of nodes whose string `field` starts with `prefix`, ascending by it"""
+        values, keys = self.ordered(field)
+        lo = bisect.bisect_left(values, sort_value(prefix))
+        hi = bisect.bisect_left(values, sort_value(prefix + "\U0010ffff"))
+        return keys[lo:hi]
+
+    def _index(self, key: str, node: Node):
+        #  assignment to an existing key keeps its position in the bucket
+        self._by_role.setdefault(node.role.value, {})[key] = node
+        self._by_type.setdefault(str(node.type), {})[key] = node
+        self._by_name.setdefault(node.name, {})[key] = node
+        for name in getattr(node, "inputs", None) or ():
+            self._consumers.setdefault(name, {})[key] = node
+
+    def _unindex(self, key: str, node: Node, replacement: Optional[Node] = None):
+        if replacement is None or replacement.role != node.role:
+            _discard(self._by_role, node.role.value, key)
+        if replacement is None or str(replacement.type) != str(node.type):
+            _discard(self._by_type, str(node.type), key)
+        if replacement is None or replacement.name != node.name:
+            _discard(self._by_name, node.name, key)
+        keep = set(getattr(replacement, "inputs", None) or ())
+        for name in getattr(node, "inputs", None) or ():
+            if name not in keep:
+                _discard(self._consumers, name, key)
 
     def deserialize(self, tomltext: str):
-        self.items = []
-        c = toml.loads(tomltext)
+        nodes = parse_nodes(tomltext)
+        self.clear()
+        for model in nodes:
+            self.add(model)
 
-        #  top-level keys are: sources, transforms, sinks
-        for role, items in c.items():
-            for name, node in items.items():
-                attrs = node.copy()
-                node_type = attrs["type"]
-                #  find class:
-                node_r = NodeRole(role)
-                model_factory = node_subclass_registry.model_for_role_type(node_r, node_type)
-                model = model_factory(**attrs, name=name)
-                self.items.append(model)
-                print(model.dict())
+    def topology(self) -> TopologyReport:
+        """Graph checks and topological order, cached until the conf changes"""
+        cached = self._topology
+        if cached is None or cached[0] != self.revision:
+            cached = self._topology = (self.revision, analyze(self))
+        return cached[1]
+
+    def ordered_nodes(self) -> Iterator[Node]:
+        """Nodes in topological order; those in or behind a cycle follow in insertion order"""
+        order = self.topology().order
+        for key in order:
+            yield self._nodes[key]
+        if len(order) < len(self._nodes):
+            emitted = set(order)
+            for key, node in self._nodes.items():
+                if key not in emitted:
+                    yield node
 
     def serialize(self) -> str:
-        d = dict(
-            sources={},
-            transforms={},
-            sinks={}
-        )
-        for node in self.items:
-            # attrs = node.dict()
-            # # attrs["type"] = node.type.value
-            # name = attrs.pop("name")
-            # role = attrs.pop("role")
-            # d[role.value][name] = attrs
-            name = node.name
-            role = node.role.value
-            d[role][name] = node.dict()
-        return toml.dumps(d)
+        started = metrics.start()
+        text = "".join(self.serialize_iter())
+        metrics.stop("serialize", started)
+        return text
+
+    def serialize_iter(self) -> Iterator[str]:
+        """TOML of the conf, a node at a time (see serialize_nodes). The
+        nodes are taken when called: changes made meanwhile do not show."""
+        return serialize_nodes(list(self.ordered_nodes()))
+
+    def render_iter(self) -> Iterator[str]:
+        """As serialize_iter, or the text kept by remember_rendered. Once
+        the chunks are all taken, the text is kept if it is small enough."""
+        cached = self.cached_rendered()
+        if cached is not None:
+            return iter((cached.text,))
+        return self._remembering(self.revision, self.serialize_iter())
+
+    def _remembering(self, revision: int, chunks: Iterator[str]) -> Iterator[str]:
+        kept: Optional[List[str]] = []
+        size = 0
+        for chunk in chunks:
+            if kept is not None:
+                size += len(chunk)
+                if size <= CACHED_TEXT_SIZE:
+                    kept.append(chunk)
+                else:
+                    kept = None
+            yield chunk
+        if kept is not None:
+            self.remember_rendered(revision, "".join(kept))
+
+    def rendered(self) -> Rendered:
+        """TOML text with its revision, kept until the conf changes if it
+        is small enough"""
+        cached = self.cached_rendered()
+        if cached is None:
+            cached = self.remember_rendered(self.revision, self.serialize())
+        return cached
+
+    def cached_rendered(self) -> Optional[Rendered]:
+        cached = self._rendered
+        if cached is None or cached.revision != self.revision:
+            return None
+        return cached
+
+    def remember_rendered(self, revision: int, text: str) -> Rendered:
+        """Keep text rendered elsewhere (e.g. in a worker process) for
+        `revision`, if it is no longer than CACHED_TEXT_SIZE"""
+        rendered = Rendered(revision, text)
+        if revision == self.revision and len(text) <= CACHED_TEXT_SIZE:
+            self._rendered = rendered
+        return rendered
+
+
+def parse_nodes(tomltext: str) -> List[Node]:
+    """Parse TOML text and validate every node in it"""
+    with metrics.timed("toml_loads"):
+        c = toml.loads(tomltext)
+    nodes = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    #  top-level keys are: sources, transforms, sinks
+    for role, items in c.items():
+        if not isinstance(items, dict):
+            raise ValueError(f"{role} is not a table of nodes")
+        for name, node in items.items():
+            if not isinstance(node, dict):
+                raise ValueError(f"{role}.{name} is not a table")
+            attrs = node.copy()
+            model = build_node(role, name, attrs)
+            nodes.append(model)
+            if debug:
+                logger.debug("parsed node %s", model.get_key(), extra={"node": model.get_key(), "attrs": model.dict()})
+    return nodes
+
+
+def _discard(index: Dict[str, Dict[str, Node]], value: str, key: str):
+    bucket = index.get(value)
+    if bucket is None:
+        return
+    bucket.pop(key, None)
+    if not bucket:
+        del index[value]
 
 
 class ConfLoad(BaseModel):
-    text: str
\ No newline at end of file
+    text: str
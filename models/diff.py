@@ -0,0 +1,58 @@
+"""Node-level differences between two confs"""
+
+from typing import List, Dict, Any, Mapping
+
+from pydantic import BaseModel
+
+
+class FieldChange(BaseModel):
+    old: Any = None
+    new: Any = None
+
+
+class ConfDiff(BaseModel):
+    "Keys of nodes only in the second conf"
+    added: List[str] = []
+    "Keys of nodes only in the first conf"
+    removed: List[str] = []
+    "Changed fields (dotted paths for nested options) of nodes in both confs, by key"
+    modified: Dict[str, Dict[str, FieldChange]] = {}
+    "Number of nodes equal in both confs"
+    unchanged: int = 0
+
+
+def diff_confs(a, b) -> ConfDiff:
+    """Differences from conf `a` to conf `b`.
+
+    Nodes are matched by key and compared by content hash first (interned
+    nodes are even the same object), so only changed nodes are compared
+    field by field.
+    """
+    result = ConfDiff()
+    for key in a.keys():
+        if key not in b:
+            result.removed.append(key)
+    for key in b.keys():
+        if key not in a:
+            result.added.append(key)
+            continue
+        old, new = a.get(key), b.get(key)
+        if old is new or a.digest(key) == b.digest(key):
+            result.unchanged += 1
+            continue
+        result.modified[key] = diff_fields(old.dict(), new.dict())
+    return result
+
+
+def diff_fields(old: Mapping[str, Any], new: Mapping[str, Any], prefix: str = "") -> Dict[str, FieldChange]:
+    changes = {}
+    for name in list(old) + [n for n in new if n not in old]:
+        o, n = old.get(name), new.get(name)
+        if o == n:
+            continue
+        path = f"{prefix}{name}"
+        if isinstance(o, Mapping) and isinstance(n, Mapping):
+            changes.update(diff_fields(o, n, prefix=f"{path}."))
+        else:
+            changes[path] = FieldChange(old=o, new=n)
+    return changes
@@ -0,0 +1,99 @@
+"""Content-addressed sharing of nodes across confs.
+
+Most confs of a fleet are made of the same nodes. Nodes are interned by a
+hash of their content, so all confs holding an equal node hold the same
+object. Nodes are immutable: an edit builds a new node (copy-on-write),
+which is interned in turn, and nodes no conf uses any more are released.
+"""
+
+import sys
+import weakref
+
+from typing import Optional, Dict, Any
+
+from pydantic import BaseModel
+
+from .validation import node_digest
+from .lazy import LazyNode
+
+
+def deep_sizeof(obj: Any, _seen=None) -> int:
+    """Approximate memory taken by a node: the objects it holds, counted once"""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, BaseModel):
+        size += deep_sizeof(obj.__dict__, seen)
+    elif isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif isinstance(obj, LazyNode):
+        size += deep_sizeof(obj.attrs, seen)
+    return size
+
+
+class NodePool:
+
+    def __init__(self):
+        #  digest -> node, for nodes still used somewhere
+        self._nodes: "weakref.WeakValueDictionary[str, BaseModel]" = weakref.WeakValueDictionary()
+        #  id(node) -> digest of interned nodes, and digest -> approximate size,
+        #  measured when first asked for (it costs more than building a stored node)
+        self._digests: Dict[int, str] = {}
+        self._sizes: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def lookup(self, digest: str) -> Optional[BaseModel]:
+        return self._nodes.get(digest)
+
+    def intern(self, node: BaseModel, digest: Optional[str] = None) -> BaseModel:
+        """The shared node equal to `node`, which becomes shared if there is none yet.
+        `digest` may be given when known, see validation.node_digest"""
+        known = self._digests.get(id(node))
+        if known is not None:
+            return node
+        if digest is None:
+            digest = node_digest(node.role.value, node.name, node.dict())
+        existing = self._nodes.get(digest)
+        if existing is not None:
+            self.hits += 1
+            return existing
+        self.misses += 1
+        self._nodes[digest] = node
+        self._digests[id(node)] = digest
+        weakref.finalize(node, self._release, id(node), digest)
+        return node
+
+    def digest_of(self, node: BaseModel) -> str:
+        digest = self._digests.get(id(node))
+        if digest is None:
+            digest = self._digests[id(self.intern(node))]
+        return digest
+
+    def size_of(self, digest: str) -> int:
+        size = self._sizes.get(digest)
+        if size is None:
+            node = self._nodes.get(digest)
+            if node is None:
+                return 0
+            size = self._sizes[digest] = deep_sizeof(node)
+        return size
+
+    def stats(self) -> Dict[str, int]:
+        digests = list(self._nodes.keys())
+        return dict(nodes=len(digests), bytes=sum(self.size_of(d) for d in digests), hits=self.hits, misses=self.misses)
+
+    def _release(self, node_id: int, digest: str):
+        self._digests.pop(node_id, None)
+        if digest not in self._nodes:
+            self._sizes.pop(digest, None)
+
+
+node_pool = NodePool()
@@ -0,0 +1,129 @@
+"""Nodes kept as their stored attributes until a model is needed.
+
+A conf loaded from storage holds attributes produced by Node.dict() of a
+valid node, so building and validating pydantic models for all of its
+nodes up front buys nothing: listing, sorting, diffing and rendering work
+on the attributes. The model of a node is built on first access to a
+field the attributes do not answer, and kept with it.
+"""
+
+from typing import Optional, Dict, Any, Mapping, List, Tuple, Type
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON, SHAPE_LIST
+
+from .usertypes import NodeRole, node_subclass_registry
+from .validation import construct_model
+
+
+class LazyNode:
+    """Stored node: role, name and attributes (as given by Node.dict()).
+
+    Behaves as the node model for reading; like it, it is immutable and an
+    edit builds a new node.
+    """
+
+    __slots__ = ("role", "name", "attrs", "_model", "__weakref__")
+
+    def __init__(self, role: NodeRole, name: str, attrs: Dict[str, Any]):
+        self.role = role
+        self.name = name
+        self.attrs = attrs
+        self._model: Optional[BaseModel] = None
+
+    @classmethod
+    def stored(cls, role: NodeRole, name: str, attrs: Mapping[str, Any]) -> "LazyNode":
+        """Node from stored attrs. Stored JSON has sorted keys: they are put
+        back in the order of the fields, so the node renders as its model does."""
+        node_cls = node_subclass_registry.class_for_role_type(role, attrs["type"])
+        return cls(role, name, _in_field_order(node_cls, attrs))
+
+    @property
+    def type(self) -> str:
+        return self.attrs["type"]
+
+    @property
+    def inputs(self):
+        return self.attrs.get("inputs")
+
+    def get_key(self) -> str:
+        return f"{self.role.value}.{self.name}"
+
+    def field(self, name: str) -> Any:
+        """Value of a field as stored, without building the model"""
+        if name in ("role", "name"):
+            return getattr(self, name)
+        return self.attrs.get(name)
+
+    def dict(self) -> Dict[str, Any]:
+        return dict(self.attrs)
+
+    def display_dict(self) -> Mapping[str, Any]:
+        return dict(**self.attrs, id=self.get_key(), role=self.role.value)
+
+    def model(self) -> BaseModel:
+        """The node model, built (without validation) on first use"""
+        if self._model is None:
+            cls = node_subclass_registry.class_for_role_type(self.role, self.type)
+            self._model = construct_model(cls, dict(self.attrs, role=self.role, name=self.name))
+        return self._model
+
+    def copy(self, update: Optional[Mapping[str, Any]] = None) -> "LazyNode":
+        """New node with `update` applied; not validated, as BaseModel.copy"""
+        attrs = dict(self.attrs)
+        name = self.name
+        for field, value in (update or {}).items():
+            if field == "name":
+                name = value
+            else:
+                attrs[field] = value
+        return LazyNode(self.role, name, attrs)
+
+    def __getattr__(self, name: str) -> Any:
+        #  called for names other than the slots and properties above
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.model(), name)
+
+    def __reduce__(self):
+        #  the model, if built, is not worth pickling
+        return LazyNode, (self.role, self.name, self.attrs)
+
+    def __repr__(self) -> str:
+        return f"LazyNode({self.get_key()!r}, type={self.type!r})"
+
+
+#  model class -> its fields, with the model class of nested options
+_layouts: Dict[Type[BaseModel], List[Tuple[str, Optional[Type[BaseModel]]]]] = {}
+
+
+def _layout(cls: Type[BaseModel]) -> List[Tuple[str, Optional[Type[BaseModel]]]]:
+    layout = _layouts.get(cls)
+    if layout is None:
+        layout = []
+        for name, field in cls.__fields__.items():
+            nested = field.type_
+            if not (isinstance(nested, type) and issubclass(nested, BaseModel)
+                    and field.shape in (SHAPE_SINGLETON, SHAPE_LIST)):
+                nested = None
+            layout.append((name, nested))
+        _layouts[cls] = layout
+    return layout
+
+
+def _in_field_order(cls: Type[BaseModel], attrs: Mapping[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for name, nested in _layout(cls):
+        if name not in attrs:
+            continue
+        value = attrs[name]
+        if nested is not None:
+            if isinstance(value, Mapping):
+                value = _in_field_order(nested, value)
+            elif isinstance(value, list):
+                value = [_in_field_order(nested, v) if isinstance(v, Mapping) else v for v in value]
+        result[name] = value
+    if len(result) < len(attrs):
+        #  keys the class does not know of keep their place at the end
+        result.update((k, v) for k, v in attrs.items() if k not in result)
+    return result
@@ -0,0 +1,138 @@
+"""Timings and counts of the service, in the Prometheus text format.
+
+Recording is off until enabled (see Settings.metrics): a timer is then a
+flag test, so the hot paths it wraps cost the same as without it.
+"""
+
+import bisect
+import time
+
+from contextlib import contextmanager
+
+from typing import Optional, List, Dict, Tuple, Iterator, Union
+
+
+#  seconds, from a dict lookup to a big conf
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Number = Union[int, float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: Number) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Observed values by label values, counted in buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        #  label values -> [count per bucket (the last one unbounded), sum]
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def samples(self) -> Iterator[str]:
+        for values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {_number(total[0])}"
+            yield f"{self.name}_count{_labels(self.labels, values)} {cumulative}"
+
+
+class Gauge:
+    """Values set when the metrics are collected; `kind` "counter" for
+    running totals kept elsewhere (e.g. cache hits)"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.kind = kind
+        self._values: Dict[Tuple[str, ...], Number] = {}
+
+    def set(self, value: Number, *label_values: str):
+        self._values[label_values] = value
+
+    def samples(self) -> Iterator[str]:
+        for values, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, values)} {_number(value)}"
+
+
+class Metrics:
+
+    def __init__(self, prefix: str = "vector_conf_api"):
+        self.prefix = prefix
+        self.enabled = False
+        self._metrics: Dict[str, Union[Histogram, Gauge]] = {}
+        self.steps = self.histogram(
+            "step_seconds", "Time spent in a step of handling confs", ("step",))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self._add(Histogram(f"{self.prefix}_{name}", help, labels, **kwargs))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = (), kind: str = "gauge") -> Gauge:
+        return self._add(Gauge(f"{self.prefix}_{name}", help, labels, kind))
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already exists")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def start(self) -> Optional[float]:
+        """Start of a step, None when not recording"""
+        return time.perf_counter() if self.enabled else None
+
+    def stop(self, step: str, started: Optional[float]):
+        if started is not None:
+            self.steps.observe(time.perf_counter() - started, step)
+
+    @contextmanager
+    def timed(self, step: str):
+        started = self.start()
+        try:
+            yield
+        finally:
+            self.stop(step, started)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            samples = list(metric.samples())
+            if not samples:
+                continue
+            help = metric.help.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {metric.name} {help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
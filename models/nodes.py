@@ -171,6 +171,9 @@ class TlsOptions(BaseModel):
 
 
 class Node(BaseModel, abc.ABC):
+    #  nodes are shared between confs (see intern.NodePool)
+    __slots__ = ('__weakref__',)
+
     type: str
     role: NodeRole
     # type: NodeType = NodeType.file
@@ -183,6 +186,10 @@ class Node(BaseModel, abc.ABC):
         d["type"] = str(d["type"])
         return d
 
+    class Config:
+        #  edits build new nodes, a shared one is never changed in place
+        allow_mutation = False
+
     def get_key(self):
         return f"{self.role.value}.{self.name}"
     
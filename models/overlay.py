@@ -0,0 +1,79 @@
+"""Confs which override a few nodes and fields of a parent conf"""
+
+from typing import Dict, Any, Mapping
+
+from pydantic import BaseModel
+
+import toml
+
+from .conf import Conf, build_node, split_key
+
+
+class OverlayLoad(BaseModel):
+    "Id of the conf to override"
+    parent: str
+    "TOML with the overridden fields of parent nodes, and nodes the parent has not"
+    text: str
+
+
+class Overlay(BaseModel):
+    parent: str
+    "Overridden fields by node key; full attributes for nodes not in the parent"
+    nodes: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_toml(cls, parent: str, tomltext: str) -> "Overlay":
+        c = toml.loads(tomltext)
+        nodes = {}
+        for role, items in c.items():
+            for name, attrs in items.items():
+                key = f"{role}.{name}"
+                split_key(key)
+                nodes[key] = attrs
+        return cls(parent=parent, nodes=nodes)
+
+    def to_toml(self) -> str:
+        d = {}
+        for key, attrs in self.nodes.items():
+            role, name = split_key(key)
+            d.setdefault(role.value, {})[name] = attrs
+        return toml.dumps(d)
+
+    def resolve(self, base: Conf) -> Conf:
+        """Effective conf: nodes of `base` with the overrides applied.
+
+        Nodes which are not overridden are taken from `base` as they are
+        (they are shared, see intern.NodePool); only overridden and added
+        nodes are validated.
+        """
+        conf = Conf()
+        for node in base:
+            key = node.get_key()
+            override = self.nodes.get(key)
+            if override is None:
+                conf.add(node)
+            else:
+                conf.add(_build(key, merge_attrs(node.dict(), override)))
+        for key, attrs in self.nodes.items():
+            if key not in base:
+                conf.add(_build(key, attrs))
+        return conf
+
+
+def _build(key: str, attrs: Mapping[str, Any]):
+    role, name = split_key(key)
+    try:
+        return build_node(role, name, attrs)
+    except ValueError as e:
+        raise ValueError(f"{key}: {e}")
+
+
+def merge_attrs(base: Mapping[str, Any], override: Mapping[str, Any]) -> Dict[str, Any]:
+    """`base` with values of `override`; nested options are merged field by field"""
+    result = dict(base)
+    for name, value in override.items():
+        if isinstance(value, Mapping) and isinstance(result.get(name), Mapping):
+            result[name] = merge_attrs(result[name], value)
+        else:
+            result[name] = value
+    return result
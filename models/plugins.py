@@ -0,0 +1,130 @@
+"""Node types defined outside of models/nodes.py.
+
+A plugin is a module with node classes registered the usual way:
+
+    from typing_extensions import Literal
+    from models.nodes import DescendantNode
+    from models.usertypes import NodeRole, node_subclass_registry
+
+    @node_subclass_registry(NodeRole.sinks)
+    class SinkKafka(DescendantNode):
+        type: Literal['kafka'] = 'kafka'
+        ...
+
+Plugins are found in plugin directories (every *.py file) and through the
+`vector_conf_api.nodes` entry points of installed packages, named after
+the node key, e.g. `sinks.kafka = my_package.kafka:SinkKafka`. Finding
+them imports nothing: files of plugin directories are read with `ast`,
+and a plugin is imported when a conf first uses one of its types.
+"""
+
+import ast
+import importlib
+import os
+import sys
+import types
+
+from typing import List, Tuple, Dict, Callable, Iterable
+
+
+ENTRY_POINT_GROUP = "vector_conf_api.nodes"
+
+#  package whose path is the plugin directories, so that plugin modules (and
+#  nodes pickled for worker processes) have importable names
+PACKAGE = "vector_conf_plugins"
+
+
+def scan_plugin(path: str) -> List[Tuple[str, str]]:
+    """(role, type) of the node classes a plugin file registers"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+    found = []
+    for statement in tree.body:
+        if not isinstance(statement, ast.ClassDef):
+            continue
+        role = _registered_role(statement)
+        node_type = _type_default(statement)
+        if role is not None and node_type is not None:
+            found.append((role, node_type))
+    return found
+
+
+def _registered_role(cls: ast.ClassDef):
+    """`sinks` for a class decorated with @node_subclass_registry(NodeRole.sinks)"""
+    for decorator in cls.decorator_list:
+        if (isinstance(decorator, ast.Call) and getattr(decorator.func, "id", None) == "node_subclass_registry"
+                and decorator.args and isinstance(decorator.args[0], ast.Attribute)):
+            return decorator.args[0].attr
+    return None
+
+
+def _type_default(cls: ast.ClassDef):
+    """`kafka` for a class with a `type: Literal['kafka'] = 'kafka'` field"""
+    for statement in cls.body:
+        if (isinstance(statement, ast.AnnAssign) and getattr(statement.target, "id", None) == "type"
+                and statement.value is not None):
+            value = statement.value
+            if isinstance(value, ast.Constant) and isinstance(value.value, str):
+                return value.value
+            if isinstance(value, ast.Str):
+                return value.s
+    return None
+
+
+def plugin_package(plugin_dirs: Iterable[str]):
+    """Create (or update) the package the modules of plugin directories belong to"""
+    package = sys.modules.get(PACKAGE)
+    if package is None:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = []
+        sys.modules[PACKAGE] = package
+    for directory in plugin_dirs:
+        directory = os.path.abspath(directory)
+        if directory not in package.__path__:
+            package.__path__.append(directory)
+    return package
+
+
+def directory_plugins(plugin_dirs: Iterable[str]) -> Dict[Tuple[str, str], Callable[[], object]]:
+    """Loaders of the node types of plugin directories, by (role, type)"""
+    plugin_dirs = [d for d in plugin_dirs if d]
+    plugin_package(plugin_dirs)
+    loaders = {}
+    for directory in plugin_dirs:
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".py") or filename.startswith("_"):
+                continue
+            module = f"{PACKAGE}.{filename[:-3]}"
+            for key in scan_plugin(os.path.join(directory, filename)):
+                #  the first directory providing a type wins
+                loaders.setdefault(key, _module_loader(module))
+    return loaders
+
+
+def _module_loader(module: str):
+    def load():
+        return importlib.import_module(module)
+    return load
+
+
+def entry_point_plugins() -> Dict[Tuple[str, str], Callable[[], object]]:
+    """Loaders of the node types of installed packages, by (role, type).
+    A loader returns the node class."""
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            from importlib_metadata import entry_points
+        except ImportError:
+            return {}
+    found = entry_points()
+    if hasattr(found, "select"):
+        group = found.select(group=ENTRY_POINT_GROUP)
+    else:
+        group = found.get(ENTRY_POINT_GROUP, ())
+    loaders = {}
+    for entry_point in group:
+        role, _, node_type = entry_point.name.partition(".")
+        if node_type:
+            loaders.setdefault((role, node_type), entry_point.load)
+    return loaders
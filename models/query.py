@@ -0,0 +1,243 @@
+"""Server-side filtering and sorting of conf items (react-admin list params)"""
+
+from enum import Enum
+
+from typing import Optional, List, Any, Mapping, Tuple, NamedTuple, Callable
+
+from pydantic import BaseModel
+
+import base64
+import binascii
+import bisect
+import json
+
+from .lazy import LazyNode
+from .usertypes import node_subclass_registry
+
+
+#  filter keys with special meaning, all others are matched against node fields
+NAME_PREFIX_FILTERS = ("name_prefix", "q")
+INDEXED_FILTERS = ("role", "type")
+
+
+def field_value(node, field: str) -> Any:
+    if field == "id":
+        return node.get_key()
+    if isinstance(node, LazyNode):
+        #  sorting and filtering do not need the model
+        return node.field(field)
+    return getattr(node, field, None)
+
+
+def check_sort_field(field: str) -> str:
+    """The field, if nodes can be sorted by it: "id" or a field of a node class.
+    Each field sorted by keeps an order with the conf (see Conf.ordered)."""
+    if not (isinstance(field, str) and (field == "id" or field in node_subclass_registry.field_names())):
+        raise ValueError(f"Invalid sort field: {field}")
+    return field
+
+
+def sort_value(value: Any) -> Tuple[int, Any]:
+    """Key which makes values of mixed types comparable (and JSON friendly):
+    None first, then booleans, numbers, strings and everything else as JSON"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, bool):
+        return (1, int(value))
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, BaseModel):
+        value = value.dict()
+    return (4, json.dumps(value, sort_keys=True, default=str))
+
+
+def _matches(node, field: str, expected: Any) -> bool:
+    value = field_value(node, field)
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(expected, list):
+        return value in expected
+    return value == expected
+
+
+def _ids(ids: Any) -> List[str]:
+    """Keys an `id` filter gives: one or a list"""
+    ids = ids if isinstance(ids, list) else [ids]
+    if not all(isinstance(i, str) for i in ids):
+        raise ValueError(f"Invalid id filter: {ids}")
+    return ids
+
+
+def select_keys(conf, filter: Optional[Mapping[str, Any]] = None,
+        sort_field: Optional[str] = None, order: str = "ASC") -> List[str]:
+    """Keys of nodes matching `filter`, in the requested order.
+
+    Role and type filters go through the conf indexes, name prefix through
+    the cached name order; remaining filters are equality (or membership,
+    for list values) tests on scalar node fields.
+    """
+    filter = dict(filter or {})
+    if order not in ("ASC", "DESC"):
+        raise ValueError(f"Invalid sort order: {order}")
+
+    candidates = None
+    ids = filter.pop("id", None)
+    if ids is not None:
+        candidates = set(_ids(ids))
+
+    index_args = {}
+    for name in INDEXED_FILTERS:
+        value = filter.pop(name, None)
+        if value is not None and not isinstance(value, str):
+            #  several values (or not a name): leave it to the generic matching below
+            filter[name] = value
+        elif value is not None:
+            index_args["node_type" if name == "type" else name] = value
+    if index_args:
+        keys = set(conf.keys(**index_args))
+        candidates = keys if candidates is None else candidates & keys
+
+    prefix = None
+    for name in NAME_PREFIX_FILTERS:
+        prefix = filter.pop(name, prefix)
+    if prefix is not None and not isinstance(prefix, str):
+        raise ValueError(f"Invalid name prefix: {prefix}")
+    if prefix:
+        keys = set(conf.keys_with_prefix("name", prefix))
+        candidates = keys if candidates is None else candidates & keys
+
+    if sort_field:
+        _, ordered = conf.ordered(sort_field)
+        if order == "DESC":
+            ordered = reversed(ordered)
+    else:
+        ordered = conf.keys()
+
+    result = []
+    for key in ordered:
+        if candidates is not None and key not in candidates:
+            continue
+        if filter:
+            node = conf.get(key)
+            if not all(_matches(node, f, v) for f, v in filter.items()):
+                continue
+        result.append(key)
+    return result
+
+
+#  types of the values sort_value gives, by their first item
+_SORT_TYPES = {0: int, 1: int, 2: (int, float), 3: str, 4: str}
+
+
+class Cursor(NamedTuple):
+    """Position in a listing of conf items: after the node `key`, whose sort
+    value is `value`, in the order of `field`, among those matching `filter`.
+    `index` is the place of that node in the order at `revision` of the conf.
+    Without a key, the start of the listing."""
+    field: str = "id"
+    order: str = "ASC"
+    filter: Optional[Mapping[str, Any]] = None
+    value: Optional[Tuple[int, Any]] = None
+    key: Optional[str] = None
+    revision: int = -1
+    index: int = -1
+
+    def encode(self) -> str:
+        """Opaque form handed to clients"""
+        text = json.dumps(list(self), separators=(",", ":"))
+        return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+    @classmethod
+    def decode(cls, text: str) -> "Cursor":
+        try:
+            fields = json.loads(base64.urlsafe_b64decode(text + "=" * (-len(text) % 4)))
+            if not isinstance(fields, list):
+                raise ValueError("not a list")
+            cursor = cls(*fields)
+        except (ValueError, TypeError, binascii.Error):
+            raise ValueError(f"Invalid cursor: {text}")
+        if cursor.order not in ("ASC", "DESC"):
+            raise ValueError(f"Invalid sort order: {cursor.order}")
+        if not (isinstance(cursor.field, str)
+                and (cursor.filter is None or isinstance(cursor.filter, dict))
+                and (cursor.key is None or isinstance(cursor.key, str))
+                and all(isinstance(i, int) and not isinstance(i, bool) for i in (cursor.revision, cursor.index))):
+            raise ValueError(f"Invalid cursor: {text}")
+        check_sort_field(cursor.field)
+        if cursor.key is not None:
+            if not (isinstance(cursor.value, list) and len(cursor.value) == 2
+                    and _SORT_TYPES.get(cursor.value[0]) is not None
+                    and isinstance(cursor.value[1], _SORT_TYPES[cursor.value[0]])):
+                raise ValueError(f"Invalid cursor: {text}")
+            #  a tuple again, as sort_value gives
+            cursor = cursor._replace(value=tuple(cursor.value))
+        return cursor
+
+
+def _predicate(filter: Optional[Mapping[str, Any]]) -> Optional[Callable[[str, Any], bool]]:
+    """Test of a node (by key) against `filter`, as select_keys applies it"""
+    filter = dict(filter or {})
+    if not filter:
+        return None
+    ids = filter.pop("id", None)
+    if ids is not None:
+        ids = set(_ids(ids))
+    prefix = None
+    for name in NAME_PREFIX_FILTERS:
+        prefix = filter.pop(name, prefix)
+    if prefix is not None and not isinstance(prefix, str):
+        raise ValueError(f"Invalid name prefix: {prefix}")
+
+    def matches(key: str, node) -> bool:
+        if ids is not None and key not in ids:
+            return False
+        if prefix and not (isinstance(node.name, str) and node.name.startswith(prefix)):
+            return False
+        return all(_matches(node, f, v) for f, v in filter.items())
+
+    return matches
+
+
+def select_page(conf, cursor: Cursor, limit: int) -> Tuple[List[str], Optional[Cursor]]:
+    """Up to `limit` keys after `cursor`, and the cursor of the next page
+    (None at the end).
+
+    The page starts from the cursor's place in the cached order of its
+    field, so it costs the nodes it scans, not the nodes before it. Nodes
+    added or removed meanwhile neither shift the page nor repeat: the
+    place is found again by sort value and key when the conf changed.
+    """
+    values, keys = conf.ordered(cursor.field)
+    descending = cursor.order == "DESC"
+    if cursor.key is None:
+        position = len(keys) - 1 if descending else 0
+    elif (cursor.revision == conf.revision and 0 <= cursor.index < len(keys)
+            and keys[cursor.index] == cursor.key):
+        position = cursor.index - 1 if descending else cursor.index + 1
+    else:
+        #  nodes with the cursor's sort value are in order of their keys
+        lo = bisect.bisect_left(values, cursor.value)
+        hi = bisect.bisect_right(values, cursor.value, lo)
+        if descending:
+            position = bisect.bisect_left(keys, cursor.key, lo, hi) - 1
+        else:
+            position = bisect.bisect_right(keys, cursor.key, lo, hi)
+    matches = _predicate(cursor.filter)
+    step = -1 if descending else 1
+    page: List[str] = []
+    last = position
+    while 0 <= position < len(keys) and len(page) < limit:
+        key = keys[position]
+        if matches is None or matches(key, conf.get(key)):
+            page.append(key)
+            last = position
+        position += step
+    if len(page) < limit or not 0 <= position < len(keys):
+        return page, None
+    following = cursor._replace(
+        value=values[last], key=keys[last], revision=conf.revision, index=last)
+    return page, following
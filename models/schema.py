@@ -0,0 +1,207 @@
+"""JSON Schemas of node types, for building editing forms.
+
+Schemas are pydantic's, with the documentation of fields added (the string
+literal written above a field, as in models/nodes.py), the options of
+`Literal` fields as `enum`, and without `role` and `name`, which are not
+part of a node body. They are generated once per version of the registry.
+"""
+
+import ast
+import hashlib
+import inspect
+import json
+import textwrap
+
+from typing import Dict, Tuple, List, Any, Optional, NamedTuple
+
+from pydantic import BaseModel
+from pydantic.schema import get_flat_models_from_model, get_model_name_map
+from pydantic.typing import is_literal_type, literal_values
+
+from .usertypes import NodeRole, node_subclass_registry
+#  registers the built-in node types
+from . import nodes  # noqa: F401
+
+
+#  fields of every node which are not part of its body
+NODE_ONLY_FIELDS = ("role", "name")
+
+_docs: Dict[type, Dict[str, str]] = {}
+
+
+class Document(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def document(content: Any) -> Document:
+    #  keys keep the order of fields, which forms follow
+    body = json.dumps(content).encode("utf-8")
+    return Document(body, f'"{hashlib.sha256(body).hexdigest()[:20]}"')
+
+
+def field_docs(cls: type) -> Dict[str, str]:
+    """Documentation of the fields of a model class and of its bases"""
+    if cls in _docs:
+        return _docs[cls]
+    docs = {}
+    for base in reversed(cls.__mro__):
+        if base is cls or (isinstance(base, type) and issubclass(base, BaseModel) and base is not BaseModel):
+            docs.update(_own_field_docs(base))
+    _docs[cls] = docs
+    return docs
+
+
+def class_doc(cls: type) -> Optional[str]:
+    """The docstring of the class itself, unless it is the doc of its first field"""
+    doc = cls.__dict__.get("__doc__")
+    if not doc or doc.strip() in _own_field_docs(cls).values():
+        return None
+    return inspect.cleandoc(doc)
+
+
+def _own_field_docs(cls: type) -> Dict[str, str]:
+    try:
+        source = textwrap.dedent(inspect.getsource(cls))
+    except (OSError, TypeError):
+        return {}
+    lines = source.splitlines()
+    tree = ast.parse(source)
+    if not tree.body or not isinstance(tree.body[0], ast.ClassDef):
+        return {}
+    body = tree.body[0].body
+    docs = {}
+    for index, (statement, following) in enumerate(zip(body, body[1:])):
+        if not (isinstance(statement, ast.Expr) and isinstance(following, ast.AnnAssign)):
+            continue
+        text = _string(statement.value)
+        if text is None:
+            continue
+        line = lines[statement.lineno - 1][statement.col_offset:]
+        if index == 0 and line.startswith(('"""', "'''")):
+            #  the docstring of the class
+            continue
+        target = getattr(following.target, "id", None)
+        if target is not None:
+            docs[target] = text.strip()
+    return docs
+
+
+def _string(value) -> Optional[str]:
+    if isinstance(value, ast.Constant) and isinstance(value.value, str):
+        return value.value
+    if isinstance(value, ast.Str):
+        return value.s
+    return None
+
+
+def _describe(schema: dict, cls: type):
+    """Add docs and literal options to the properties of a model's schema"""
+    docs = field_docs(cls)
+    doc = class_doc(cls)
+    if doc is None:
+        schema.pop("description", None)
+    else:
+        schema["description"] = doc
+    properties = schema.get("properties", {})
+    for name, field in cls.__fields__.items():
+        prop = properties.get(field.alias)
+        if prop is None:
+            continue
+        if name in docs and "description" not in prop:
+            prop["description"] = docs[name]
+        if is_literal_type(field.type_):
+            prop["enum"] = list(literal_values(field.type_))
+            prop.pop("const", None)
+
+
+def node_schema(cls: type) -> dict:
+    schema = cls.schema()
+    _describe(schema, cls)
+    for name in NODE_ONLY_FIELDS:
+        schema.get("properties", {}).pop(name, None)
+        if name in schema.get("required", ()):
+            schema["required"].remove(name)
+    definitions = schema.get("definitions", {})
+    models = get_flat_models_from_model(cls)
+    for model, name in get_model_name_map(models).items():
+        if name in definitions and isinstance(model, type) and issubclass(model, BaseModel):
+            _describe(definitions[name], model)
+    _drop_unused(schema)
+    return schema
+
+
+def _drop_unused(schema: dict):
+    """Remove definitions only the removed fields referred to"""
+    definitions = schema.get("definitions", {})
+    while definitions:
+        text = json.dumps(schema)
+        unused = [name for name in definitions if f'"#/definitions/{name}"' not in text]
+        if not unused:
+            break
+        for name in unused:
+            del definitions[name]
+    if not definitions:
+        schema.pop("definitions", None)
+
+
+class SchemaCatalog:
+    """Schemas of all registered node types, rebuilt when the registry changes"""
+
+    def __init__(self):
+        self._version = None
+        self._schemas: Dict[Tuple[str, str], Document] = {}
+        self._index: Optional[Document] = None
+        self._catalog: Optional[Document] = None
+
+    def schema(self, role: NodeRole, node_type: str) -> Document:
+        """Raises ValueError for a type not registered"""
+        cls = node_subclass_registry.class_for_role_type(role, node_type)
+        self._check_version()
+        key = (role.value, node_type)
+        if key not in self._schemas:
+            self._schemas[key] = document(node_schema(cls))
+        return self._schemas[key]
+
+    def index(self) -> Document:
+        """Role, type, title and description of every registered type"""
+        classes = node_subclass_registry.node_classes()
+        self._check_version()
+        if self._index is None:
+            self._index = document(dict(version=self._version, types=self._entries(classes)))
+        return self._index
+
+    def catalog(self) -> Document:
+        """The index and the schemas of all types"""
+        classes = node_subclass_registry.node_classes()
+        self._check_version()
+        if self._catalog is None:
+            schemas = {}
+            for role, types in classes.items():
+                for node_type in types:
+                    schemas[f"{role}.{node_type}"] = json.loads(self.schema(NodeRole(role), node_type).body)
+            self._catalog = document(dict(version=self._version, types=self._entries(classes), schemas=schemas))
+        return self._catalog
+
+    def _entries(self, classes) -> List[Dict[str, str]]:
+        return [
+            dict(
+                role=role,
+                type=node_type,
+                title=cls.__name__,
+                description=class_doc(cls) or "",
+                schema=f"/schema/{role}/{node_type}",
+            )
+            for role, types in sorted(classes.items())
+            for node_type, cls in sorted(types.items())
+        ]
+
+    def _check_version(self):
+        if self._version != node_subclass_registry.version:
+            self._version = node_subclass_registry.version
+            self._schemas.clear()
+            self._index = None
+            self._catalog = None
+
+
+catalog = SchemaCatalog()
@@ -0,0 +1,121 @@
+"""Pipeline graph of a conf: nodes are linked by `inputs` of transforms and sinks"""
+
+from collections import deque
+
+from typing import List, Dict, Set
+
+from pydantic import BaseModel
+
+from .usertypes import NodeRole
+
+
+class TopologyReport(BaseModel):
+    "Keys of nodes in topological order (producers before consumers); nodes in or after a cycle are left out"
+    order: List[str] = []
+    "Input names which do not match any node, by consumer key"
+    unknown_inputs: Dict[str, List[str]] = {}
+    "Names used by more than one node, with their keys"
+    duplicate_names: Dict[str, List[str]] = {}
+    "Strongly connected groups of nodes, by key"
+    cycles: List[List[str]] = []
+    "Sources which no transform or sink consumes"
+    orphan_sources: List[str] = []
+    "Sinks with empty or missing inputs"
+    sinks_without_inputs: List[str] = []
+
+    @property
+    def ok(self) -> bool:
+        return not (self.unknown_inputs or self.duplicate_names or self.cycles
+                    or self.orphan_sources or self.sinks_without_inputs)
+
+
+def analyze(conf) -> TopologyReport:
+    """Check the graph of `conf` and order it, in O(nodes + inputs)"""
+    report = TopologyReport()
+    keys = list(conf.keys())
+
+    #  edges: producer key -> consumer keys
+    consumers: Dict[str, List[str]] = {key: [] for key in keys}
+    indegree: Dict[str, int] = dict.fromkeys(keys, 0)
+    for key in keys:
+        node = conf.get(key)
+        inputs = getattr(node, "inputs", None) or ()
+        if node.role == NodeRole.sinks and not inputs:
+            report.sinks_without_inputs.append(key)
+        for name in inputs:
+            producers = conf.keys_named(name)
+            if not producers:
+                report.unknown_inputs.setdefault(key, []).append(name)
+            for producer in producers:
+                consumers[producer].append(key)
+                indegree[key] += 1
+
+    for key in conf.keys(role=NodeRole.sources):
+        if not consumers[key]:
+            report.orphan_sources.append(key)
+    for name, named in conf.duplicate_names():
+        report.duplicate_names[name] = named
+
+    #  Kahn's algorithm, stable with respect to insertion order
+    queue = deque(key for key in keys if indegree[key] == 0)
+    remaining = dict(indegree)
+    while queue:
+        key = queue.popleft()
+        report.order.append(key)
+        for consumer in consumers[key]:
+            remaining[consumer] -= 1
+            if remaining[consumer] == 0:
+                queue.append(consumer)
+
+    if len(report.order) < len(keys):
+        emitted = set(report.order)
+        report.cycles = _cycles([key for key in keys if key not in emitted], consumers)
+    return report
+
+
+def _cycles(keys: List[str], consumers: Dict[str, List[str]]) -> List[List[str]]:
+    """Strongly connected components (Tarjan, iterative) of the subgraph of `keys`
+    which contain a cycle"""
+    subgraph: Set[str] = set(keys)
+    edges = {key: [c for c in consumers[key] if c in subgraph] for key in keys}
+    index: Dict[str, int] = {}
+    lowlink: Dict[str, int] = {}
+    stack: List[str] = []
+    on_stack: Set[str] = set()
+    result = []
+    counter = 0
+
+    for root in keys:
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            key, pos = work.pop()
+            if pos == 0:
+                index[key] = lowlink[key] = counter
+                counter += 1
+                stack.append(key)
+                on_stack.add(key)
+            for i in range(pos, len(edges[key])):
+                nxt = edges[key][i]
+                if nxt not in index:
+                    work.append((key, i + 1))
+                    work.append((nxt, 0))
+                    break
+                if nxt in on_stack:
+                    lowlink[key] = min(lowlink[key], index[nxt])
+            else:
+                if lowlink[key] == index[key]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == key:
+                            break
+                    if len(component) > 1 or key in consumers[key]:
+                        result.append(component[::-1])
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[key])
+    return result
@@ -1,7 +1,6 @@
 from enum import Enum
 
-import functools
-
+from typing import Iterable, Mapping, FrozenSet
 
 
 class NodeRole(str, Enum):
@@ -25,34 +24,132 @@ class NodeRole(str, Enum):
 
 
 class node_subclass_registry:
+    """Node classes by role and type.
+
+    Classes register themselves when their module is imported. Plugins
+    (see models.plugins) are found on the first lookup of a type which is
+    not registered, and imported when one of their types is looked up.
+    """
 
     _node_classes = {}
     _codes = {}
+    #  (role, type) -> constructor of validated nodes, built once per type
+    _constructors = {}
+    #  (role value, type) -> loader of a plugin not imported yet
+    _plugins = {}
+    _plugin_dirs = []
+    _discovered = False
+    #  (version, names of the fields of all node classes)
+    _field_names = (-1, frozenset())
+    #  moves whenever a class is registered
+    version = 0
 
     def __init__(self, node_role: NodeRole):
         self.node_role = node_role
 
     def __call__(self, node_subcls):
-        registry = node_subclass_registry._node_classes
-        node_role = self.node_role.value
-        # node_type = self.node_type.value
-        # node_type = node_subcls.type
         node_type = node_subcls.__fields__["type"].default
+        node_subclass_registry.register(self.node_role, node_type, node_subcls)
+        return node_subcls
+
+    @classmethod
+    def register(cls, node_role: NodeRole, node_type: str, node_subcls):
+        registry = cls._node_classes
+        node_role = NodeRole(node_role).value
         roles_registry = registry.get(node_role, {})
         if node_type in roles_registry:
             raise KeyError(f'Node class for {node_type} already registered')
         roles_registry[node_type] = node_subcls
         registry[node_role] = roles_registry
-        return node_subcls
+        cls.version += 1
 
     @classmethod
-    def model_for_role_type(cls, node_role: NodeRole, node_type: str):
-        roles_registry = cls._node_classes[node_role.value]
+    def configure(cls, plugin_dirs: Iterable[str] = ()):
+        """Look for plugins in these directories (and entry points) from now on"""
+        from . import plugins
+        cls._plugin_dirs = [d for d in plugin_dirs if d]
+        cls._discovered = False
+        #  nodes of plugins may come pickled from another process before any
+        #  plugin is looked up here
+        plugins.plugin_package(cls._plugin_dirs)
+
+    @classmethod
+    def class_for_role_type(cls, node_role: NodeRole, node_type: str):
         try:
-            subcls = roles_registry[node_type]
-        except Exception as e:
+            return cls._node_classes[node_role.value][node_type]
+        except KeyError:
+            pass
+        cls._load(node_role.value, node_type)
+        try:
+            return cls._node_classes[node_role.value][node_type]
+        except KeyError:
             raise ValueError(f"No such type registered: {node_type}")
-        return functools.partial(subcls, role=node_role)
+
+    @classmethod
+    def model_for_role_type(cls, node_role: NodeRole, node_type: str):
+        """Callable building a validated node of the type from its attributes and name"""
+        try:
+            return cls._constructors[(node_role, node_type)]
+        except KeyError:
+            pass
+        constructor = cls._constructors[(node_role, node_type)] = _constructor(
+            cls.class_for_role_type(node_role, node_type), node_role)
+        return constructor
+
+    @classmethod
+    def node_classes(cls) -> Mapping[str, Mapping[str, type]]:
+        """All node classes by role and type, plugins imported"""
+        cls._discover()
+        for node_role, node_type in list(cls._plugins):
+            cls._load(node_role, node_type)
+        return cls._node_classes
+
+    @classmethod
+    def field_names(cls) -> FrozenSet[str]:
+        """Names of the fields of all node classes, plugins imported"""
+        classes = cls.node_classes()
+        if cls._field_names[0] != cls.version:
+            cls._field_names = (cls.version, frozenset(
+                name for by_type in classes.values() for node_cls in by_type.values() for name in node_cls.__fields__))
+        return cls._field_names[1]
+
+    @classmethod
+    def _load(cls, node_role: str, node_type: str):
+        cls._discover()
+        loader = cls._plugins.pop((node_role, node_type), None)
+        if loader is None:
+            return
+        loaded = loader()
+        #  entry points may name a class which does not register itself
+        if isinstance(loaded, type) and node_type not in cls._node_classes.get(node_role, {}):
+            cls.register(NodeRole(node_role), node_type, loaded)
+
+    @classmethod
+    def _discover(cls):
+        if cls._discovered:
+            return
+        from . import plugins
+        found = plugins.entry_point_plugins()
+        #  plugin directories win over installed packages
+        found.update(plugins.directory_plugins(cls._plugin_dirs))
+        cls._plugins = {
+            key: loader for key, loader in found.items()
+            if key[1] not in cls._node_classes.get(key[0], {})}
+        cls._discovered = True
+
+
+def _constructor(node_subcls, node_role: NodeRole):
+    def construct(**values):
+        return node_subcls(role=node_role, **values)
+    return construct
+
+
+class NodeOpKind(str, Enum):
+    add = 'add'
+    replace = 'replace'
+    merge = 'merge'
+    remove = 'remove'
+    rename = 'rename'
 
 
 class FileFingerprintingStrategy(str, Enum):
@@ -0,0 +1,92 @@
+"""Reuse of validated nodes and construction of trusted ones.
+
+Validating a node runs every pydantic validator of its class and of its
+nested models. Nodes are immutable (edits build new ones), so a node
+validated once can be handed out again for the same body.
+"""
+
+import copy
+import hashlib
+import json
+
+from collections import OrderedDict
+from enum import Enum
+
+from typing import Optional, Any, Mapping, Type
+
+from pydantic import BaseModel
+from pydantic.fields import ModelField, SHAPE_SINGLETON, SHAPE_LIST
+
+
+def canonical_json(attrs: Mapping[str, Any]) -> str:
+    """JSON of node attributes which does not depend on their order"""
+    return json.dumps(attrs, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def node_digest(role: str, name: str, attrs: Optional[Mapping[str, Any]] = None, canonical: Optional[str] = None) -> str:
+    """Hash of a node body. For a valid node, the hash of its Node.dict()
+    is its content address (see intern.NodePool)"""
+    if canonical is None:
+        canonical = canonical_json(attrs)
+    return hashlib.blake2b(f"{role}\0{name}\0{canonical}".encode("utf-8"), digest_size=20).hexdigest()
+
+
+class NodeCache:
+    """Validated nodes by digest of (role, name, attrs), least recently used dropped first"""
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._nodes: "OrderedDict[str, BaseModel]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def get(self, digest: str) -> Optional[BaseModel]:
+        node = self._nodes.get(digest)
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._nodes.move_to_end(digest)
+        return node
+
+    def put(self, digest: str, node: BaseModel):
+        self._nodes[digest] = node
+        self._nodes.move_to_end(digest)
+        while len(self._nodes) > self.max_size:
+            self._nodes.popitem(last=False)
+
+    def clear(self):
+        self._nodes.clear()
+
+
+node_cache = NodeCache()
+
+
+def construct_model(cls: Type[BaseModel], values: Mapping[str, Any]) -> BaseModel:
+    """Build a model from data it produced itself (e.g. dict() of a stored node)
+    without validation. Nested models and enums are rebuilt, other values are
+    taken as they are."""
+    data = {}
+    for name, field in cls.__fields__.items():
+        if name in values:
+            data[name] = _construct_value(field, values[name])
+        elif not field.required:
+            data[name] = copy.deepcopy(field.default)
+    return cls.construct(_fields_set=set(values) & set(data), **data)
+
+
+def _construct_value(field: ModelField, value: Any) -> Any:
+    tp = field.type_
+    if value is None or not isinstance(tp, type):
+        return value
+    if issubclass(tp, BaseModel):
+        if field.shape == SHAPE_SINGLETON and isinstance(value, Mapping):
+            return construct_model(tp, value)
+        if field.shape == SHAPE_LIST and isinstance(value, list):
+            return [construct_model(tp, v) if isinstance(v, Mapping) else v for v in value]
+    elif issubclass(tp, Enum) and field.shape == SHAPE_SINGLETON and not isinstance(value, tp):
+        return tp(value)
+    return value
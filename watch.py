@@ -0,0 +1,152 @@
+"""Waiting for confs to change, for long-poll and event stream clients.
+
+An idle subscriber costs a suspended coroutine and a timer. One task per
+process looks for changes to the watched confs (made by this or any other
+app process) and wakes the subscribers of those which changed.
+"""
+
+import asyncio
+
+from typing import Optional, Dict, List, Set
+
+from db.store import ConfStore
+
+
+class ConfWatch:
+
+    def __init__(self, store: ConfStore, interval: float = 0.1):
+        self.store = store
+        #  seconds between looks for changes: a read of the change counter,
+        #  or a query when the store has no counter
+        self.interval = interval
+        #  subscriptions and last seen stored revision of each watched conf
+        self._subscriptions: Dict[str, Set["Subscription"]] = {}
+        self._revisions: Dict[str, Optional[int]] = {}
+        self._seen: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def watching(self, conf_id: str) -> "Subscription":
+        """Watch a conf and its parents. Enter it before reading the revision
+        the client has to be told about, so that no change falls in between:
+
+            async with watch.watching(conf_id) as subscription:
+                revision = ...
+                changed = await subscription.wait(timeout)
+        """
+        return Subscription(self, conf_id)
+
+    def stats(self) -> Dict[str, int]:
+        subscriptions = set()
+        for subscribed in self._subscriptions.values():
+            subscriptions.update(subscribed)
+        return dict(confs=len(self._subscriptions), subscriptions=len(subscriptions))
+
+    async def _add(self, subscription: "Subscription"):
+        new = [conf_id for conf_id in subscription.chain if conf_id not in self._subscriptions]
+        for conf_id in subscription.chain:
+            self._subscriptions.setdefault(conf_id, set()).add(subscription)
+        if new:
+            stored = await self.store.revisions(new)
+            for conf_id in new:
+                self._revisions.setdefault(conf_id, stored.get(conf_id))
+
+    def _remove(self, subscription: "Subscription"):
+        for conf_id in subscription.chain:
+            subscribed = self._subscriptions.get(conf_id)
+            if subscribed is None:
+                continue
+            subscribed.discard(subscription)
+            if not subscribed:
+                del self._subscriptions[conf_id]
+                self._revisions.pop(conf_id, None)
+
+    def notify(self, conf_id: str):
+        """Wake the subscribers of conf_id"""
+        for subscription in self._subscriptions.get(conf_id, ()):
+            subscription.changed()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._subscriptions:
+                continue
+            try:
+                await self.check()
+            except Exception:
+                #  e.g. the database is busy: look again later
+                continue
+
+    async def check(self) -> List[str]:
+        """Wake subscribers of watched confs whose stored revision moved, or
+        which were deleted. Returns their ids."""
+        counter = self.store.counter
+        if counter is not None:
+            seen = counter.value()
+            if seen == self._seen:
+                return []
+        watched = list(self._revisions)
+        stored = await self.store.revisions(watched)
+        changed = [conf_id for conf_id in watched if stored.get(conf_id) != self._revisions.get(conf_id)]
+        for conf_id in changed:
+            if conf_id in self._revisions:
+                self._revisions[conf_id] = stored.get(conf_id)
+            self.notify(conf_id)
+        if counter is not None:
+            self._seen = seen
+        return changed
+
+
+class Subscription:
+
+    def __init__(self, watch: ConfWatch, conf_id: str):
+        self.watch = watch
+        self.conf_id = conf_id
+        self.chain: List[str] = []
+        #  a change came since the last wait(), or since the subscription started
+        self._pending = False
+        self._waiter: Optional[asyncio.Future] = None
+
+    async def __aenter__(self) -> "Subscription":
+        self.chain = await self.watch.store.chain(self.conf_id)
+        await self.watch._add(self)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.watch._remove(self)
+
+    def changed(self):
+        self._pending = True
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the conf or one of its parents changes, since the last
+        wait() or since the subscription started. False on timeout."""
+        if not self._pending:
+            loop = asyncio.get_event_loop()
+            self._waiter = loop.create_future()
+            timer = loop.call_later(timeout, self._expire) if timeout is not None else None
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+                if timer is not None:
+                    timer.cancel()
+        changed, self._pending = self._pending, False
+        return changed
+
+    def _expire(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
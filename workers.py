@@ -0,0 +1,192 @@
+"""Parsing, validation and rendering of big confs in worker processes.
+
+toml and pydantic work holds the GIL, so done in the event loop (or in
+Starlette's thread pool) it stalls every other request. Small confs are
+still handled inline, where a round trip to a worker would cost more than
+the work itself.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from typing import Optional, List, Tuple, Dict, Union
+
+from models.conf import Conf, Rendered, build_node, parse_nodes
+from models.validation import canonical_json, node_digest
+from models.metrics import metrics
+from models.nodes import Node
+from models.usertypes import node_subclass_registry
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConfTooLarge(ValueError):
+    pass
+
+
+class WorkerTimeout(Exception):
+    pass
+
+
+def parse_encoded(tomltext: str) -> Tuple[List[Node], List[str], List[str]]:
+    """Nodes of the text, their attributes as JSON, ready to be stored, and
+    their content digests.
+
+    Runs in a worker. Errors are passed back as plain ValueError: pydantic
+    validation errors do not survive pickling.
+    """
+    try:
+        nodes = parse_nodes(tomltext)
+    except Exception as e:
+        raise ValueError(str(e)) from None
+    encoded = [canonical_json(node.dict()) for node in nodes]
+    digests = [node_digest(node.role.value, node.name, canonical=attrs) for node, attrs in zip(nodes, encoded)]
+    return nodes, encoded, digests
+
+
+def parse_stored(tomltext: str) -> Tuple[List[Tuple[str, str]], List[str], List[str]]:
+    """As parse_encoded, but with (role, name) of the nodes instead of the
+    nodes: the caller builds them from the JSON, which is much cheaper to
+    pass between processes than pickled models."""
+    nodes, encoded, digests = parse_encoded(tomltext)
+    return [(node.role.value, node.name) for node in nodes], encoded, digests
+
+
+def parse_stored_batch(tomltexts: List[str]) -> List[Union[Tuple[List[Tuple[str, str]], List[str], List[str]], str]]:
+    """parse_stored of each text, or the message of its error: a conf which
+    is not valid does not fail the others of the batch"""
+    results = []
+    for tomltext in tomltexts:
+        try:
+            results.append(parse_stored(tomltext))
+        except ValueError as e:
+            results.append(str(e))
+    return results
+
+
+def render_nodes(nodes: List[Node]) -> str:
+    return Conf(nodes).serialize()
+
+
+class ConfWorkers:
+
+    def __init__(self, processes: Optional[int] = None, timeout: float = 30.0,
+            max_size: int = 16 * 1024 * 1024, inline_size: int = 64 * 1024, inline_nodes: int = 500,
+            batch_size: int = 1024 * 1024, plugin_dirs: List[str] = ()):
+        #  None means one process per CPU
+        self.processes = processes
+        #  seconds to wait for a worker; the worker itself finishes its job anyway
+        self.timeout = timeout
+        #  longest conf text accepted, in characters
+        self.max_size = max_size
+        #  texts up to this size and confs up to this many nodes are handled inline
+        self.inline_size = inline_size
+        self.inline_nodes = inline_nodes
+        #  characters of text sent to a worker in one job by deserialize_many
+        self.batch_size = batch_size
+        #  workers find node type plugins where the app does
+        self.plugin_dirs = list(plugin_dirs)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        if self._pool is None and self.processes != 0:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=node_subclass_registry.configure,
+                initargs=(self.plugin_dirs,))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def deserialize(self, tomltext: str) -> Tuple[Conf, Dict[str, str]]:
+        """Parsed conf and stored form (JSON) of its nodes, by key"""
+        if len(tomltext) > self.max_size:
+            raise ConfTooLarge(f"Conf is larger than {self.max_size} characters")
+        if self._pool is None or len(tomltext) <= self.inline_size:
+            nodes, encoded, digests = parse_encoded(tomltext)
+        else:
+            with metrics.timed("worker_parse"):
+                stored = await self._run(parse_stored, tomltext)
+            return self._from_stored(*stored)
+        conf = Conf(nodes)
+        return conf, {node.get_key(): attrs for node, attrs in zip(nodes, encoded)}
+
+    async def deserialize_many(self, tomltexts: List[str]) -> List[Union[Tuple[Conf, Dict[str, str]], Exception]]:
+        """deserialize of each text, or the error it raised. The texts go to
+        the workers whatever their size, several to a job, with no more
+        jobs at a time than there are workers."""
+        if self._pool is None:
+            results = []
+            for tomltext in tomltexts:
+                try:
+                    results.append(await self.deserialize(tomltext))
+                except Exception as e:
+                    results.append(e)
+            return results
+        results: List[Union[Tuple[Conf, Dict[str, str]], Exception, None]] = [None] * len(tomltexts)
+        batches: List[List[int]] = [[]]
+        size = 0
+        for index, tomltext in enumerate(tomltexts):
+            if len(tomltext) > self.max_size:
+                results[index] = ConfTooLarge(f"Conf is larger than {self.max_size} characters")
+                continue
+            if batches[-1] and size + len(tomltext) > self.batch_size:
+                batches.append([])
+                size = 0
+            batches[-1].append(index)
+            size += len(tomltext)
+        slots = asyncio.Semaphore(self.processes or os.cpu_count() or 1)
+
+        async def parse(batch: List[int]):
+            async with slots:
+                try:
+                    with metrics.timed("worker_parse"):
+                        parsed = await self._run(parse_stored_batch, [tomltexts[index] for index in batch])
+                except WorkerTimeout as e:
+                    for index in batch:
+                        results[index] = e
+                    return
+            for index, result in zip(batch, parsed):
+                results[index] = ValueError(result) if isinstance(result, str) else self._from_stored(*result)
+
+        await asyncio.gather(*(parse(batch) for batch in batches if batch))
+        return results
+
+    def _from_stored(self, names: List[Tuple[str, str]], encoded: List[str],
+            digests: List[str]) -> Tuple[Conf, Dict[str, str]]:
+        #  validated in the worker: share the nodes other confs already hold,
+        #  build the others from their stored form
+        nodes = [
+            build_node(role, name, json.loads(attrs), trusted=True, digest=digest)
+            for (role, name), attrs, digest in zip(names, encoded, digests)]
+        conf = Conf(nodes)
+        return conf, {node.get_key(): attrs for node, attrs in zip(nodes, encoded)}
+
+    async def render(self, conf: Conf) -> Rendered:
+        cached = conf.cached_rendered()
+        if cached is not None:
+            return cached
+        if self._pool is None or len(conf) <= self.inline_nodes:
+            return conf.rendered()
+        revision = conf.revision
+        with metrics.timed("worker_render"):
+            text = await self._run(render_nodes, list(conf.ordered_nodes()))
+        return conf.remember_rendered(revision, text)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(self._pool, func, *args)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning("no result from a worker in %s seconds", self.timeout, extra={"job": func.__name__})
+            raise WorkerTimeout(f"No result from a worker in {self.timeout} seconds")